@@ -0,0 +1,60 @@
+from absl import app
+from absl import flags
+import time
+import numpy as np
+
+import sort
+
+flags.DEFINE_list(
+	'sizes', ['1x1', '1x2', '2x2', '2x3', '3x3', '4x4', '5x5', '8x8', '16x16', '64x64'], 'Cost matrix sizes (detections x trackers) to time.'
+)
+flags.DEFINE_integer(
+	'calls', 2000, 'Number of calls timed per solver and size.'
+)
+flags.DEFINE_integer(
+	'seed', 0, 'Seed for the random boxes.'
+)
+FLAGS = flags.FLAGS
+
+def random_cost_matrices(num_detections, num_trackers, count, rng):
+	"""Negative IOU matrices between jittered copies of random boxes, like the ones
+	associate_detections_to_trackers solves."""
+
+	matrices = []
+	for _ in range(count):
+		centers = rng.uniform(0, 1, (max(num_detections, num_trackers), 2))
+		sizes = rng.uniform(0.02, 0.1, centers.shape)
+		boxes = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1)
+		detections = boxes[:num_detections] + rng.normal(0, 0.01, (num_detections, 4))
+		trackers = boxes[:num_trackers] + rng.normal(0, 0.01, (num_trackers, 4))
+		matrices.append(-sort.iou_batch(detections, trackers))
+	return matrices
+
+def time_solver(solver, matrices):
+	"""Mean latency of one call, in microseconds."""
+
+	start = time.perf_counter()
+	for matrix in matrices:
+		solver(matrix)
+	return (time.perf_counter() - start) / len(matrices) * 1e6
+
+def main(argv):
+	rng = np.random.default_rng(FLAGS.seed)
+
+	names = [name for name in sort.ASSIGNMENT_SOLVERS if name != 'lapjv' or sort._lap_available()] + ['auto']
+	print('size     ' + ''.join(f'{name:>14}' for name in names) + '   (us per call)')
+
+	for size in FLAGS.sizes:
+		num_detections, num_trackers = (int(n) for n in size.split('x'))
+		matrices = random_cost_matrices(num_detections, num_trackers, FLAGS.calls, rng)
+
+		row = f'{size:<9}'
+		for name in names:
+			if name == 'brute_force' and sort.perm(max(num_detections, num_trackers), min(num_detections, num_trackers)) > sort.BRUTE_FORCE_MAX_PERMUTATIONS:
+				row += f'{"-":>14}'
+				continue
+			row += f'{time_solver(sort.get_solver(name), matrices):>14.1f}'
+		print(row)
+
+if __name__ == '__main__':
+	app.run(main)
@@ -10,12 +10,19 @@ import glob
 import os
 import re
 
-import pandas as pd
+import numpy as np
+
+# Default location of the beam width csv files
+BEAM_WIDTH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'beam_widths')
+
+BEAM_WIDTH_COLUMNS = ('beam_num', 'beam_center', 'beam_left', 'beam_right')
 
 def parse_beam_header_file(fp):
     """ Utility to parse the beam width header files.
     """
 
+    import pandas as pd
+
     # example of what we are trying to parse:
     # DEFINE_BEAMWIDTH3(0, -13.5735, -13.7893, -13.3577)
 
@@ -74,14 +81,10 @@ def make_csv_files_for_beam_widths(beam_dir, output_dir):
 
 
 
-def load_beam_width_data(frame, beam_width_dir):
-    """ Load in the beam spacing file that corresponds to the correct ARIS setup for this frame.
+def get_beam_width_name(system_type, beam_count, used_telephoto):
+    """ The name of the beam width table (e.g. 'ARIS1800_96') for an ARIS setup.
     """
 
-    system_type = frame.thesystemtype
-    beam_count = frame.BeamCount
-    used_telephoto = frame.largelens
-
     beam_width_fn = None
 
     # ARIS 1800
@@ -106,13 +109,13 @@ def load_beam_width_data(frame, beam_width_dir):
                 beam_width_fn = 'ARIS1800_96.csv'
 
         else:
-            raise ValueEror("Invalid Beam Count %d for ARIS 1800" % (beam_count,))
+            raise ValueError("Invalid Beam Count %d for ARIS 1800" % (beam_count,))
 
     # ARIS 3000
     elif system_type == 1:
 
         if used_telephoto:
-            raise ValueEror("Don't know telephoto beam widths for ARIS 3000")
+            raise ValueError("Don't know telephoto beam widths for ARIS 3000")
 
         if beam_count == 64:
             # ARIS3000_64
@@ -123,13 +126,13 @@ def load_beam_width_data(frame, beam_width_dir):
             beam_width_fn = 'ARIS3000_128.csv'
 
         else:
-            raise ValueEror("Invalid Beam Count %d for ARIS 3000" % (beam_count,))
+            raise ValueError("Invalid Beam Count %d for ARIS 3000" % (beam_count,))
 
     # ARIS 1200
     elif system_type == 2:
 
         if beam_count != 48:
-            raise ValueEror("Invalid Beam Count %d for ARIS 1200" % (beam_count,))
+            raise ValueError("Invalid Beam Count %d for ARIS 1200" % (beam_count,))
 
         if used_telephoto:
             # ARIS_Telephoto_48
@@ -141,13 +144,82 @@ def load_beam_width_data(frame, beam_width_dir):
     else:
         raise ValueError("Unknown System Type: %s" % (system_type,))
 
+    return beam_width_fn.replace('.csv', '')
+
+
+def read_beam_width_file(fp):
+    """ Read a beam width csv file into a dict of contiguous numpy arrays, one per
+    column (see BEAM_WIDTH_COLUMNS).
+    """
+
+    table = np.loadtxt(fp, delimiter=',', skiprows=1, ndmin=2)
+
+    beam_widths = {
+        'beam_num': np.ascontiguousarray(table[:, 0].astype(np.int64)),
+        'beam_center': np.ascontiguousarray(table[:, 1]),
+        'beam_left': np.ascontiguousarray(table[:, 2]),
+        'beam_right': np.ascontiguousarray(table[:, 3]),
+    }
+
+    # Simple sanity check, the geometry code indexes the tables by beam number
+    assert np.array_equal(beam_widths['beam_num'], np.arange(table.shape[0]))
+
+    return beam_widths
+
+
+def make_beam_width_bundle(beam_width_dir, output_path):
+    """ Bundle all of the beam width csv files in beam_width_dir into a single .npz
+    file, which can be passed to load_beam_width_data() in place of the directory.
+    """
+
+    arrays = {}
+    for fp in sorted(glob.glob(os.path.join(beam_width_dir, '*.csv'))):
+        name = os.path.splitext(os.path.basename(fp))[0]
+        for column, values in read_beam_width_file(fp).items():
+            arrays[name + '/' + column] = values
+
+    np.savez(output_path, **arrays)
+
+
+# Beam width tables that have been loaded, keyed by (source, name)
+_BEAM_WIDTH_TABLES = {}
+
+def get_beam_widths(name, beam_width_dir=None):
+    """ Load the beam width table `name` from a directory of csv files or from a
+    bundle made by make_beam_width_bundle(). Each table is only read once per process;
+    the returned arrays are shared and read only.
+    """
+
+    if beam_width_dir is None:
+        beam_width_dir = BEAM_WIDTH_DIR
+
+    key = (beam_width_dir, name)
+    if key not in _BEAM_WIDTH_TABLES:
 
-    beam_width_fp = os.path.join(beam_width_dir, beam_width_fn)
+        if beam_width_dir.endswith('.npz'):
+            with np.load(beam_width_dir) as bundle:
+                beam_widths = {column: bundle[name + '/' + column] for column in BEAM_WIDTH_COLUMNS}
+        else:
+            beam_widths = read_beam_width_file(os.path.join(beam_width_dir, name + '.csv'))
+
+        for values in beam_widths.values():
+            values.setflags(write=False)
+
+        _BEAM_WIDTH_TABLES[key] = beam_widths
+
+    return _BEAM_WIDTH_TABLES[key]
 
-    # return pd.read_csv(beam_width_fp)
-    return (pd.read_csv(beam_width_fp), beam_width_fn.replace('.csv', ''))
 
+def load_beam_width_data(frame, beam_width_dir=None):
+    """ Load in the beam spacing file that corresponds to the correct ARIS setup for this frame.
+
+    Returns the beam width table as a dict of numpy arrays (see get_beam_widths())
+    and the name of the table.
+    """
+
+    beam_width_name = get_beam_width_name(frame.thesystemtype, frame.BeamCount, frame.largelens)
 
+    return (get_beam_widths(beam_width_name, beam_width_dir), beam_width_name)
 
 
 
@@ -0,0 +1,269 @@
+from absl import app
+from absl import flags
+from concurrent.futures import ProcessPoolExecutor
+import bisect
+import datetime
+import glob
+import os
+import numpy as np
+import sqlite3
+
+import pyARIS
+
+flags.DEFINE_string(
+	'aris_dir', None, 'Directory tree containing the ARIS files to catalog.'
+)
+flags.DEFINE_string(
+	'catalog_path', None, 'SQLite file to create or update.'
+)
+flags.DEFINE_string(
+	'site', None, '[Optional] Site the files were recorded at, e.g. kenai_ak. Defaults to the name of aris_dir.'
+)
+flags.DEFINE_integer(
+	'workers', 1, 'Number of files scanned concurrently.'
+)
+flags.mark_flag_as_required('aris_dir')
+flags.mark_flag_as_required('catalog_path')
+FLAGS = flags.FLAGS
+
+# File header fields stored for every file
+FILE_COLUMNS = ['version_number', 'FrameCount', 'NumRawBeams', 'SamplesPerChannel', 'SN', 'strDate', 'LargeLens', 'SoftwareVersion']
+
+# Frame header fields stored for every frame
+FRAME_COLUMNS = ['frameindex', 'sonartimestamp', 'pingmode', 'frequencyhilow', 'windowstart', 'windowlength',
+	'samplestartdelay', 'sampleperiod', 'samplesperbeam', 'soundspeed', 'framerate']
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS files (
+	file_id INTEGER PRIMARY KEY,
+	path TEXT UNIQUE NOT NULL,
+	site TEXT,
+	size INTEGER,
+	mtime_ns INTEGER,
+	num_frames INTEGER,
+	start_time INTEGER,
+	end_time INTEGER,
+	{', '.join(FILE_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS files_by_time ON files (site, start_time, end_time);
+CREATE TABLE IF NOT EXISTS frames (
+	file_id INTEGER NOT NULL,
+	frame INTEGER NOT NULL,
+	glitch INTEGER NOT NULL,
+	{', '.join(FRAME_COLUMNS)},
+	PRIMARY KEY (file_id, frame)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS frames_by_time ON frames (file_id, glitch, sonartimestamp);
+"""
+
+def to_timestamp(t):
+	"""Convert a datetime (naive datetimes are taken as UTC) to microseconds since
+	epoch, the unit of sonartimestamp. Numbers are returned unchanged."""
+
+	if isinstance(t, datetime.datetime):
+		if t.tzinfo is None:
+			t = t.replace(tzinfo=datetime.timezone.utc)
+		return int(round(t.timestamp() * 1000000))
+	return int(t)
+
+def find_glitches(timestamps, max_gap=pyARIS.MAX_FRAME_GAP):
+	"""Flag the frames whose timestamp is out of order, i.e. the frames that are not
+	part of the longest non-decreasing run of timestamps. Frames that are out of
+	order with most of the (up to) six frames nearest to them are left out of the
+	run, like ARIS_File._out_of_place() does, and the run is split wherever
+	consecutive frames are more than max_gap apart with only its longest part
+	kept, which catches glitches at the start or end of a file.
+
+	Returns:
+		bool array, True for glitched frames
+	"""
+
+	times = np.asarray(timestamps, dtype=np.float64)
+	num_frames = len(times)
+
+	# The neighbours of frame i are the 7-frame window around it, shifted to stay in the file
+	index = np.arange(num_frames)
+	start = np.minimum(np.maximum(index - 3, 0), max(num_frames - 7, 0))
+	agree = np.zeros(num_frames, dtype=int)
+	count = np.zeros(num_frames, dtype=int)
+	for offset in range(-6, 7):
+		j = index + offset
+		neighbour = (offset != 0) & (j >= start) & (j < start + 7) & (j >= 0) & (j < num_frames)
+		j = np.clip(j, 0, max(num_frames - 1, 0))
+		gap = (times[j] - times) * np.sign(offset)
+		agree += neighbour & (gap >= 0) & (gap <= max_gap)
+		count += neighbour
+	out_of_place = 2 * agree < count
+
+	# Patience sorting: tails[k] is the index of the smallest timestamp that ends a
+	# non-decreasing run of length k + 1
+	tails = []
+	tail_values = []
+	previous = np.full(len(timestamps), -1)
+	for i, t in enumerate(timestamps):
+		if out_of_place[i]:
+			continue
+		k = bisect.bisect_right(tail_values, t)
+		if k > 0:
+			previous[i] = tails[k - 1]
+		if k == len(tails):
+			tails.append(i)
+			tail_values.append(t)
+		else:
+			tails[k] = i
+			tail_values[k] = t
+
+	glitch = np.ones(len(timestamps), dtype=bool)
+	i = tails[-1] if len(tails) else -1
+	while i >= 0:
+		glitch[i] = False
+		i = previous[i]
+
+	valid = np.nonzero(~glitch)[0]
+	splits = np.nonzero(np.diff(times[valid]) > max_gap)[0] + 1
+	if len(splits):
+		parts = np.split(valid, splits)
+		glitch[:] = True
+		glitch[max(parts, key=len)] = False
+
+	return glitch
+
+def scan_file(aris_filename):
+	"""Read the file header and every frame header of an ARIS file.
+
+	Returns:
+		file_row : dict of FILE_COLUMNS plus the frame count and time range
+		frame_rows : list of (frame, glitch, *FRAME_COLUMNS) tuples, `frame` being the
+			position of the frame in the file (the index used by pyARIS.ARISReader) and
+			`glitch` flagging frames with an out of order timestamp (see find_glitches())
+	"""
+
+	with pyARIS.ARISReader(aris_filename) as reader:
+		headers = pyARIS.read_frame_headers(reader.data)
+		file_row = {column: getattr(reader.data, column) for column in FILE_COLUMNS}
+	file_row['strDate'] = file_row['strDate'].split(b'\x00', 1)[0].decode('ascii', 'replace')
+
+	timestamps = headers['sonartimestamp'].tolist()
+	glitch = find_glitches(timestamps)
+	valid_timestamps = headers['sonartimestamp'][~glitch]
+
+	file_row['num_frames'] = len(headers)
+	file_row['start_time'] = int(valid_timestamps[0]) if len(valid_timestamps) else None
+	file_row['end_time'] = int(valid_timestamps[-1]) if len(valid_timestamps) else None
+
+	columns = [range(len(headers)), glitch.astype(int).tolist()] + [headers[column].tolist() for column in FRAME_COLUMNS]
+
+	return file_row, list(zip(*columns))
+
+def connect(catalog_path):
+	"""Open (and create if needed) a catalog."""
+
+	conn = sqlite3.connect(catalog_path)
+	conn.executescript(SCHEMA)
+	return conn
+
+def build_catalog(aris_dir, catalog_path, site=None, workers=1):
+	"""Add the ARIS files under aris_dir to the catalog at catalog_path.
+
+	Files that are already cataloged with the same size and modification time are
+	skipped, files that changed are scanned again and files that were deleted from
+	aris_dir are dropped from the catalog, so running this again after new files
+	are recorded only scans the new files.
+
+	Returns:
+		the number of files that were scanned
+	"""
+
+	aris_dir = os.path.abspath(aris_dir)
+	if site is None:
+		site = os.path.basename(aris_dir)
+
+	conn = connect(catalog_path)
+
+	prefix = os.path.join(aris_dir, '')
+	cataloged = {path: (file_id, size, mtime_ns) for file_id, path, size, mtime_ns in
+		conn.execute('SELECT file_id, path, size, mtime_ns FROM files WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))}
+
+	to_scan = []
+	found = set()
+	for aris_filename in sorted(glob.glob(os.path.join(aris_dir, '**', '*.aris'), recursive=True)):
+		stat = os.stat(aris_filename)
+		found.add(aris_filename)
+		if aris_filename in cataloged and cataloged[aris_filename][1:] == (stat.st_size, stat.st_mtime_ns):
+			continue
+		to_scan.append((aris_filename, stat.st_size, stat.st_mtime_ns))
+
+	with conn:
+		for path, (file_id, _, _) in cataloged.items():
+			if path not in found:
+				conn.execute('DELETE FROM frames WHERE file_id = ?', (file_id,))
+				conn.execute('DELETE FROM files WHERE file_id = ?', (file_id,))
+
+	def add_file(aris_filename, size, mtime_ns, file_row, frame_rows):
+		# One transaction per file, so an interrupted build keeps the files that were done
+		with conn:
+			if aris_filename in cataloged:
+				file_id = cataloged[aris_filename][0]
+				conn.execute('DELETE FROM frames WHERE file_id = ?', (file_id,))
+				conn.execute('DELETE FROM files WHERE file_id = ?', (file_id,))
+
+			columns = ['path', 'site', 'size', 'mtime_ns'] + list(file_row)
+			file_id = conn.execute(f'INSERT INTO files ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})',
+				[aris_filename, site, size, mtime_ns] + list(file_row.values())).lastrowid
+			conn.executemany(f'INSERT INTO frames VALUES (?, {", ".join("?" * (len(FRAME_COLUMNS) + 2))})',
+				((file_id,) + row for row in frame_rows))
+
+	if workers <= 1:
+		for aris_filename, size, mtime_ns in to_scan:
+			add_file(aris_filename, size, mtime_ns, *scan_file(aris_filename))
+	else:
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			scanned = pool.map(scan_file, [aris_filename for aris_filename, _, _ in to_scan])
+			for (aris_filename, size, mtime_ns), result in zip(to_scan, scanned):
+				add_file(aris_filename, size, mtime_ns, *result)
+
+	conn.close()
+
+	return len(to_scan)
+
+def find_frames(conn, start_time, end_time, site=None):
+	"""Every cataloged frame with a timestamp in [start_time, end_time], in time order.
+	Times are microseconds since epoch or datetimes (see to_timestamp()). Frames with
+	glitched timestamps are left out.
+
+	Returns:
+		list of (path, frame, sonartimestamp) tuples
+	"""
+
+	return conn.execute("""
+		SELECT files.path, frames.frame, frames.sonartimestamp
+		FROM files CROSS JOIN frames
+		WHERE files.start_time <= :end AND files.end_time >= :start AND (:site IS NULL OR files.site = :site)
+			AND frames.file_id = files.file_id AND frames.glitch = 0 AND frames.sonartimestamp BETWEEN :start AND :end
+		ORDER BY frames.sonartimestamp, files.path, frames.frame
+		""", {'start': to_timestamp(start_time), 'end': to_timestamp(end_time), 'site': site}).fetchall()
+
+def find_frame(conn, time, site=None):
+	"""The cataloged frame that covers `time`, i.e. the last frame recorded at or
+	before `time` in a file whose recording spans `time`.
+
+	Returns:
+		(path, frame, sonartimestamp), or None if no file was recording at `time`
+	"""
+
+	return conn.execute("""
+		SELECT files.path, frames.frame, frames.sonartimestamp
+		FROM files CROSS JOIN frames
+		WHERE files.start_time <= :time AND files.end_time >= :time AND (:site IS NULL OR files.site = :site)
+			AND frames.file_id = files.file_id AND frames.glitch = 0 AND frames.sonartimestamp = (
+				SELECT MAX(sonartimestamp) FROM frames
+				WHERE file_id = files.file_id AND glitch = 0 AND sonartimestamp <= :time)
+		ORDER BY frames.sonartimestamp DESC, frames.frame DESC LIMIT 1
+		""", {'time': to_timestamp(time), 'site': site}).fetchone()
+
+def main(argv):
+	num_scanned = build_catalog(FLAGS.aris_dir, FLAGS.catalog_path, FLAGS.site, FLAGS.workers)
+	print(f'Scanned {num_scanned} new or changed files')
+
+if __name__ == '__main__':
+	app.run(main)
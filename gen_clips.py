@@ -0,0 +1,200 @@
+from absl import app
+from absl import flags
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import io
+import json
+import numpy as np
+import os
+from PIL import Image
+import uuid
+import zipfile
+
+from beams import load_beam_width_data
+import pyARIS
+
+flags.DEFINE_string(
+	'aris_dir', None, 'Directory containing the source ARIS files.'
+)
+flags.DEFINE_string(
+	'clip_dir', None, '[Optional] Directory to also output unzipped clip images.'
+)
+flags.DEFINE_string(
+	'dump_dir', None, 'Directory to output the json dump of created clips.'
+)
+flags.DEFINE_string(
+	'river_name', None, 'River name used to name the clips, e.g. kenai.'
+)
+flags.DEFINE_string(
+	'river_location', None, 'River location used to name the clips, e.g. ak.'
+)
+flags.DEFINE_string(
+	'zip_location', None, 'Directory to output zipped clip images for annotation.'
+)
+flags.DEFINE_string(
+	'clips_json', None, '[Optional] Json list of clips ({"aris_filename", "start_frame", "end_frame", ...}) to generate instead of splitting every file in aris_dir.'
+)
+flags.DEFINE_integer(
+	'clip_length', 300, 'Number of frames per clip when splitting the files in aris_dir.'
+)
+flags.DEFINE_enum(
+	'upstream_direction', 'left', ['left', 'right'], 'Upstream direction recorded in the clip info.'
+)
+flags.DEFINE_float(
+	'pixel_meter_size', None, '[Optional] Size of an image pixel in meters. Defaults to the smallest pixel that bounds a sample.'
+)
+flags.DEFINE_integer(
+	'workers', 1, 'Number of clips generated concurrently.'
+)
+flags.mark_flag_as_required('aris_dir')
+flags.mark_flag_as_required('dump_dir')
+flags.mark_flag_as_required('river_name')
+flags.mark_flag_as_required('river_location')
+flags.mark_flag_as_required('zip_location')
+FLAGS = flags.FLAGS
+
+def geometry_changes(frame_headers):
+	"""Indices of the frames whose geometry (see pyARIS.frame_geometry()) differs
+	from the frame before, e.g. because the window was changed while recording."""
+
+	geometry = frame_headers[list(pyARIS.GEOMETRY_FIELDS)]
+	return np.nonzero(geometry[1:] != geometry[:-1])[0] + 1
+
+def split_into_clips(aris_dir, clip_length, river_name, river_location, upstream_direction='left'):
+	"""Split every ARIS file in aris_dir into clips of clip_length frames. Files are
+	also split wherever the geometry changes, so every clip has a single geometry."""
+
+	clips = []
+	for aris_filename in sorted(glob.glob(os.path.join(aris_dir, '*.aris'))):
+		with pyARIS.ARISReader(aris_filename) as reader:
+			reader.data.map_frames()
+			num_frames = len(reader.data.frame_headers)
+			bounds = [0, *geometry_changes(reader.data.frame_headers), num_frames]
+
+		basename = os.path.splitext(os.path.basename(aris_filename))[0]
+		for segment_start, segment_end in zip(bounds[:-1], bounds[1:]):
+			for start_frame in range(segment_start, segment_end, clip_length):
+				end_frame = min(start_frame + clip_length, segment_end)
+				clips.append({
+					'aris_filename': aris_filename,
+					'clip_name': f'{river_name}_{river_location}_{basename}_{start_frame}_{end_frame}',
+					'start_frame': int(start_frame),
+					'end_frame': int(end_frame),
+					'upstream_direction': upstream_direction
+				})
+
+	return clips
+
+def make_clip(clip, zip_location, clip_dir=None, pixel_meter_size=None, beam_width_dir=None, cmap='viridis'):
+	"""Render the frames [start_frame, end_frame) of a clip straight into
+	zip_location/<clip_name>.zip and return the clip info (see data_format.md).
+
+	The image geometry is computed from the first frame of the clip. Raises a
+	ValueError if it changes within the clip (split_into_clips() never makes such
+	clips, but a clips_json can).
+	"""
+
+	with pyARIS.ARISReader(clip['aris_filename']) as reader:
+		reader.data.map_frames()
+		changes = geometry_changes(reader.data.frame_headers[clip['start_frame']:clip['end_frame']])
+		if len(changes):
+			raise ValueError('The geometry of %s changes at frame %d, within clip %s (frames %d to %d)' % (
+				clip['aris_filename'], clip['start_frame'] + changes[0], clip['clip_name'], clip['start_frame'], clip['end_frame']))
+
+		frame = reader.read_header(clip['start_frame'])
+		end_time = reader.read_header(clip['end_frame'] - 1).sonartimestamp
+
+		beam_width_data, camera_type = load_beam_width_data(frame, beam_width_dir)
+		if pixel_meter_size is None:
+			pixel_meter_size = pyARIS.get_minimum_pixel_meter_size(frame, beam_width_data)
+		xdim, ydim, x_meter_start, y_meter_start, x_meter_stop, y_meter_stop = pyARIS.compute_image_bounds(pixel_meter_size, frame, beam_width_data)
+
+		read_from, write_to = pyARIS.LUT_CACHE.get(pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start, frame, beam_width_data, flat=True)
+		lut = pyARIS.make_remap_lut(read_from, write_to, xdim, ydim, reader.data.SamplesPerChannel * reader.data.NumRawBeams)
+		table = pyARIS.colormap_table(cmap)
+
+		images = None
+		rgb = np.empty((ydim, xdim, 3), dtype=np.uint8)
+
+		if clip_dir is not None:
+			os.makedirs(os.path.join(clip_dir, clip['clip_name']), exist_ok=True)
+
+		# Write to a temporary file so that an interrupted run never leaves a partial zip behind
+		zip_path = os.path.join(zip_location, clip['clip_name'] + '.zip')
+		with zipfile.ZipFile(zip_path + '.tmp', 'w', zipfile.ZIP_STORED) as zip_file:
+			i = 0
+			for frames, _ in reader.iter_frames(clip['start_frame'], clip['end_frame']):
+				if images is None:
+					images = np.empty((len(frames), ydim, xdim), dtype=np.uint8)
+
+				for image in pyARIS.remap_batch(frames, lut, out=images[:len(frames)]):
+					jpeg = io.BytesIO()
+					Image.fromarray(pyARIS.colorize(image, table, rgb)).save(jpeg, 'JPEG')
+					zip_file.writestr(f'{i}.jpg', jpeg.getvalue())
+
+					if clip_dir is not None:
+						with open(os.path.join(clip_dir, clip['clip_name'], f'{i}.jpg'), 'wb') as f:
+							f.write(jpeg.getvalue())
+					i += 1
+		os.replace(zip_path + '.tmp', zip_path)
+
+	return {
+		'clip_id': clip.get('clip_id', str(uuid.uuid4())),
+		'aris_filename': clip['aris_filename'],
+		'clip_name': clip['clip_name'],
+		'start_frame': clip['start_frame'],
+		'end_frame': clip['end_frame'],
+		'start_time': frame.sonartimestamp,
+		'end_time': end_time,
+		'upstream_direction': clip.get('upstream_direction', 'left'),
+		'fish': clip.get('fish', []),
+		'aris_info': {
+			'camera_type': camera_type,
+			'framerate': frame.framerate,
+			'pixel_meter_size': float(pixel_meter_size),
+			'xdim': xdim,
+			'ydim': ydim,
+			'x_meter_start': float(x_meter_start),
+			'y_meter_start': float(y_meter_start),
+			'x_meter_stop': float(x_meter_stop),
+			'y_meter_stop': float(y_meter_stop)
+		}
+	}
+
+def generate_clips(clips, zip_location, workers=1, **kwargs):
+	"""Generate many clips, `workers` at a time, in separate processes.
+	Keyword arguments are passed on to make_clip(). Returns the clip infos in
+	the same order as `clips`.
+	"""
+
+	os.makedirs(zip_location, exist_ok=True)
+
+	if workers <= 1:
+		return [make_clip(clip, zip_location, **kwargs) for clip in clips]
+
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		futures = [pool.submit(make_clip, clip, zip_location, **kwargs) for clip in clips]
+		return [future.result() for future in futures]
+
+def main(argv):
+	if FLAGS.clips_json is not None:
+		with open(FLAGS.clips_json) as json_file:
+			clips = json.load(json_file)
+		for clip in clips:
+			# Relative paths are relative to aris_dir
+			clip['aris_filename'] = os.path.join(FLAGS.aris_dir, clip['aris_filename'])
+			if 'clip_name' not in clip:
+				basename = os.path.splitext(os.path.basename(clip['aris_filename']))[0]
+				clip['clip_name'] = f'{FLAGS.river_name}_{FLAGS.river_location}_{basename}_{clip["start_frame"]}_{clip["end_frame"]}'
+	else:
+		clips = split_into_clips(FLAGS.aris_dir, FLAGS.clip_length, FLAGS.river_name, FLAGS.river_location, FLAGS.upstream_direction)
+
+	json_dump = generate_clips(clips, FLAGS.zip_location, workers=FLAGS.workers,
+		clip_dir=FLAGS.clip_dir, pixel_meter_size=FLAGS.pixel_meter_size)
+
+	os.makedirs(FLAGS.dump_dir, exist_ok=True)
+	with open(os.path.join(FLAGS.dump_dir, f'{FLAGS.river_name}_{FLAGS.river_location}_clips.json'), 'w') as output_file:
+		json.dump(json_dump, output_file, indent=2)
+
+if __name__ == '__main__':
+	app.run(main)
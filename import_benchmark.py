@@ -0,0 +1,72 @@
+from absl import app
+from absl import flags
+import re
+import subprocess
+import sys
+
+flags.DEFINE_string(
+	'module', 'pyARIS', 'Module to time the import of.'
+)
+flags.DEFINE_integer(
+	'runs', 10, 'Number of fresh interpreters to time the import in.'
+)
+flags.DEFINE_float(
+	'max_ms', None, '[Optional] Fail if the median import time (excluding numpy) is above this many milliseconds.'
+)
+FLAGS = flags.FLAGS
+
+# Modules that only the image export needs. Importing pyARIS must not load them.
+DEFERRED_MODULES = ['matplotlib', 'PIL', 'tqdm', 'pytz', 'pandas', 'concurrent.futures.process']
+
+def import_time_us(module):
+	"""Cumulative import time (in microseconds) of `module` and of numpy, measured
+	with `python -X importtime` in a fresh interpreter."""
+
+	result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+		stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+	times = {}
+	for line in result.stderr.splitlines():
+		match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)', line)
+		if match is not None and match.group(3) not in times:
+			times[match.group(3)] = int(match.group(1))
+
+	return times[module], times.get('numpy', 0)
+
+def loaded_deferred_modules(module, cwd=None):
+	"""The DEFERRED_MODULES that are loaded by importing `module` in a fresh
+	interpreter started in `cwd`."""
+
+	code = f'import sys, {module}; print(" ".join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))'
+	result = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True, check=True, cwd=cwd)
+
+	return result.stdout.split()
+
+def main(argv):
+	loaded = loaded_deferred_modules(FLAGS.module)
+
+	totals = []
+	own = []
+	for _ in range(FLAGS.runs):
+		total, numpy_time = import_time_us(FLAGS.module)
+		totals.append(total / 1000.)
+		own.append((total - numpy_time) / 1000.)
+	totals.sort()
+	own.sort()
+
+	print(f'import {FLAGS.module}: median {totals[len(totals) // 2]:.1f} ms, min {totals[0]:.1f} ms')
+	print(f'  excluding numpy: median {own[len(own) // 2]:.1f} ms, min {own[0]:.1f} ms')
+
+	failed = False
+	if len(loaded):
+		print(f'FAIL: importing {FLAGS.module} loads {", ".join(loaded)}')
+		failed = True
+	if FLAGS.max_ms is not None and own[len(own) // 2] > FLAGS.max_ms:
+		print(f'FAIL: median import time excluding numpy is above {FLAGS.max_ms} ms')
+		failed = True
+
+	if failed:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	app.run(main)
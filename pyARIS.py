@@ -10,14 +10,194 @@ The most recent version can be found at: https://github.com/EminentCodfish/pyARI
 @author: Chris Rillahan
 """
 
-import struct, array, pytz, datetime, tqdm
-import os
+import struct, array, datetime
+import os, hashlib
+import queue, threading, time
+from collections import OrderedDict, deque
 import subprocess as sp
-from matplotlib import cm as colormap
-from PIL import Image, ImageFont, ImageDraw
 import numpy as np
 from beams import load_beam_width_data
 
+#matplotlib, PIL, tqdm and the executors are only needed to export images and are imported
+#where they are used, which keeps `import pyARIS` fast for tools that only
+#read headers or frames. See import_benchmark.py.
+
+
+#Layout of the 1024 byte frame header. Fields are in file order; the
+#remainder of the header after 'sentinel' is padding.
+FRAME_HEADER_FIELDS = [
+    ('frameindex', '<u4'),            # Frame number in file
+    ('frametime', '<u8'),             # PC time stamp when recorded; microseconds since epoch (Jan 1st 1970)
+    ('version', '<u4'),               # ARIS file format version = 0x05464444
+    ('status', '<u4'),
+    ('sonartimestamp', '<u8'),        # On-sonar microseconds since epoch (Jan 1st 1970)
+    ('tsday', '<u4'),
+    ('tshour', '<u4'),
+    ('tsminute', '<u4'),
+    ('tssecond', '<u4'),
+    ('tshsecond', '<u4'),
+    ('transmitmode', '<u4'),
+    ('windowstart', '<f4'),           # Window start in meters
+    ('windowlength', '<f4'),          # Window length in meters
+    ('threshold', '<u4'),
+    ('intensity', '<i4'),
+    ('receivergain', '<u4'),          # Note: 0-24 dB
+    ('degc1', '<u4'),                 # CPU temperature (C)
+    ('degc2', '<u4'),                 # Power supply temperature (C)
+    ('humidity', '<u4'),              # % relative humidity
+    ('focus', '<u4'),                 # Focus units 0-1000
+    ('battery', '<u4'),               # OBSOLETE: Unused.
+    ('uservalue1', '<f4'),
+    ('uservalue2', '<f4'),
+    ('uservalue3', '<f4'),
+    ('uservalue4', '<f4'),
+    ('uservalue5', '<f4'),
+    ('uservalue6', '<f4'),
+    ('uservalue7', '<f4'),
+    ('uservalue8', '<f4'),
+    ('velocity', '<f4'),              # Platform velocity from AUV integration
+    ('depth', '<f4'),                 # Platform depth from AUV integration
+    ('altitude', '<f4'),              # Platform altitude from AUV integration
+    ('pitch', '<f4'),                 # Platform pitch from AUV integration
+    ('pitchrate', '<f4'),             # Platform pitch rate from AUV integration
+    ('roll', '<f4'),                  # Platform roll from AUV integration
+    ('rollrate', '<f4'),              # Platform roll rate from AUV integration
+    ('heading', '<f4'),               # Platform heading from AUV integration
+    ('headingrate', '<f4'),           # Platform heading rate from AUV integration
+    ('compassheading', '<f4'),        # Sonar compass heading output
+    ('compasspitch', '<f4'),          # Sonar compass pitch output
+    ('compassroll', '<f4'),           # Sonar compass roll output
+    ('latitude', '<f8'),              # from auxiliary GPS sensor
+    ('longitude', '<f8'),             # from auxiliary GPS sensor
+    ('sonarposition', '<f4'),         # special for PNNL
+    ('configflags', '<u4'),
+    ('beamtilt', '<f4'),
+    ('targetrange', '<f4'),
+    ('targetbearing', '<f4'),
+    ('targetpresent', '<u4'),
+    ('firmwarerevision', '<u4'),      # OBSOLETE: Unused.
+    ('flags', '<u4'),
+    ('sourceframe', '<u4'),           # Source file frame number for CSOT output files
+    ('watertemp', '<f4'),             # Water temperature from housing temperature sensor
+    ('timerperiod', '<u4'),
+    ('sonarx', '<f4'),                # Sonar X location for 3D processing
+    ('sonary', '<f4'),                # Sonar Y location for 3D processing
+    ('sonarz', '<f4'),                # Sonar Z location for 3D processing
+    ('sonarpan', '<f4'),              # X2 pan output
+    ('sonartilt', '<f4'),             # X2 tilt output
+    ('sonarroll', '<f4'),             # X2 roll output  **** End of DDF_03 frame header data ****
+    ('panpnnl', '<f4'),
+    ('tiltpnnl', '<f4'),
+    ('rollpnnl', '<f4'),
+    ('vehicletime', '<f8'),           # special for Bluefin Robotics HAUV or other AUV integration
+    ('timeggk', '<f4'),               # GPS output from NMEA GGK message
+    ('dateggk', '<u4'),               # GPS output from NMEA GGK message
+    ('qualityggk', '<u4'),            # GPS output from NMEA GGK message
+    ('numsatsggk', '<u4'),            # GPS output from NMEA GGK message
+    ('dopggk', '<f4'),                # GPS output from NMEA GGK message
+    ('ehtggk', '<f4'),                # GPS output from NMEA GGK message
+    ('heavetss', '<f4'),              # external sensor
+    ('yeargps', '<u4'),               # GPS year output
+    ('monthgps', '<u4'),              # GPS month output
+    ('daygps', '<u4'),                # GPS day output
+    ('hourgps', '<u4'),               # GPS hour output
+    ('minutegps', '<u4'),             # GPS minute output
+    ('secondgps', '<u4'),             # GPS second output
+    ('hsecondgps', '<u4'),            # GPS 1/100th second output
+    ('sonarpanoffset', '<f4'),        # Sonar mount location pan offset for 3D processing
+    ('sonartiltoffset', '<f4'),       # Sonar mount location tilt offset for 3D processing
+    ('sonarrolloffset', '<f4'),       # Sonar mount location roll offset for 3D processing
+    ('sonarxoffset', '<f4'),          # Sonar mount location X offset for 3D processing
+    ('sonaryoffset', '<f4'),          # Sonar mount location Y offset for 3D processing
+    ('sonarzoffset', '<f4'),          # Sonar mount location Z offset for 3D processing
+    ('tmatrix', '<f4', (16,)),        # 3D processing transformation matrix
+    ('samplerate', '<f4'),            # Calculated as 1e6/SamplePeriod
+    ('accellx', '<f4'),               # X-axis sonar acceleration
+    ('accelly', '<f4'),               # Y-axis sonar acceleration
+    ('accellz', '<f4'),               # Z-axis sonar acceleration
+    ('pingmode', '<u4'),              # ARIS ping mode [1..12]
+    ('frequencyhilow', '<u4'),        # 1 = HF, 0 = LF
+    ('pulsewidth', '<u4'),            # Width of transmit pulse in usec, [4..100]
+    ('cycleperiod', '<u4'),           # Ping cycle time in usec, [1802..65535]
+    ('sampleperiod', '<u4'),          # Downrange sample rate in usec, [4..100]
+    ('transmitenable', '<u4'),        # 1 = Transmit ON, 0 = Transmit OFF
+    ('framerate', '<f4'),             # Instantaneous frame rate between frame N and frame N-1
+    ('soundspeed', '<f4'),            # Sound velocity in water calculated from water temperature and salinity setting
+    ('samplesperbeam', '<u4'),        # Number of downrange samples in each beam
+    ('enable150v', '<u4'),            # 1 = 150V ON (Max Power), 0 = 150V OFF (Min Power, 12V)
+    ('samplestartdelay', '<u4'),      # Delay from transmit until start of sampling (window start) in usec, [930..65535]
+    ('largelens', '<u4'),             # 1 = telephoto lens (large lens, big lens, hi-res lens) present
+    ('thesystemtype', '<u4'),         # 1 = ARIS 3000, 0 = ARIS 1800, 2 = ARIS 1200
+    ('sonarserialnumber', '<u4'),     # Sonar serial number as labeled on housing
+    ('encryptedkey', '<u8'),          # Reserved for future use
+    ('ariserrorflagsuint', '<u4'),    # Error flag code bits
+    ('missedpackets', '<u4'),         # Missed packet count for Ethernet statistics reporting
+    ('arisappversion', '<u4'),        # Version number of ArisApp sending frame data
+    ('available2', '<u4'),            # Reserved for future use
+    ('reorderedsamples', '<u4'),      # 1 = frame data already ordered into [beam,sample] array, 0 = needs reordering
+    ('salinity', '<u4'),              # Water salinity code:  0 = fresh, 15 = brackish, 35 = salt
+    ('pressure', '<f4'),              # Depth sensor output in meters (psi)
+    ('batteryvoltage', '<f4'),        # Battery input voltage before power steering
+    ('mainvoltage', '<f4'),           # Main cable input voltage before power steering
+    ('switchvoltage', '<f4'),         # Input voltage after power steering
+    ('focusmotormoving', '<u4'),      # Added 14-Aug-2012 for AutomaticRecording
+    ('voltagechanging', '<u4'),       # Added 16-Aug (first two bits = 12V, second two bits = 150V, 00 = not changing, 01 = turning on, 10 = turning off)
+    ('focustimeoutfault', '<u4'),
+    ('focusovercurrentfault', '<u4'),
+    ('focusnotfoundfault', '<u4'),
+    ('focusstalledfault', '<u4'),
+    ('fpgatimeoutfault', '<u4'),
+    ('fpgabusyfault', '<u4'),
+    ('fpgastuckfault', '<u4'),
+    ('cputempfault', '<u4'),
+    ('psutempfault', '<u4'),
+    ('watertempfault', '<u4'),
+    ('humidityfault', '<u4'),
+    ('pressurefault', '<u4'),
+    ('voltagereadfault', '<u4'),
+    ('voltagewritefault', '<u4'),
+    ('focuscurrentposition', '<u4'),  # Focus shaft current position in motor units [0.1000]
+    ('targetpan', '<f4'),             # Commanded pan position
+    ('targettilt', '<f4'),            # Commanded tilt position
+    ('targetroll', '<f4'),            # Commanded roll position
+    ('panmotorerrorcode', '<u4'),
+    ('tiltmotorerrorcode', '<u4'),
+    ('rollmotorerrorcode', '<u4'),
+    ('panabsposition', '<f4'),        # Low-resolution magnetic encoder absolute pan position
+    ('tiltabsposition', '<f4'),       # Low-resolution magnetic encoder absolute tilt position
+    ('rollabsposition', '<f4'),       # Low-resolution magnetic encoder absolute roll position
+    ('panaccelx', '<f4'),             # Accelerometer outputs from AR2 CPU board sensor
+    ('panaccely', '<f4'),
+    ('panaccelz', '<f4'),
+    ('tiltaccelx', '<f4'),
+    ('tiltaccely', '<f4'),
+    ('tiltaccelz', '<f4'),
+    ('rollaccelx', '<f4'),
+    ('rollaccely', '<f4'),
+    ('rollaccelz', '<f4'),
+    ('appliedsettings', '<u4'),       # Cookie indices for command acknowlege in frame header
+    ('constrainedsettings', '<u4'),
+    ('invalidsettings', '<u4'),
+    ('enableinterpacketdelay', '<u4'),# If true delay is added between sending out image data packets
+    ('interpacketdelayperiod', '<u4'),# packet delay factor in us (does not include function overhead time)
+    ('uptime', '<u4'),                # Total number of seconds sonar has been running
+    ('arisappversionmajor', '<u2'),   # Major version number
+    ('arisappversionminor', '<u2'),   # Minor version number
+    ('gotime', '<u8'),                # Sonar time when frame cycle is initiated in hardware
+    ('panvelocity', '<f4'),           # AR2 pan velocity in degrees/second
+    ('tiltvelocity', '<f4'),          # AR2 tilt velocity in degrees/second
+    ('rollvelocity', '<f4'),          # AR2 roll velocity in degrees/second
+    ('sentinel', '<u4'),              # Used to measure the frame header size
+]
+
+FRAME_HEADER_DTYPE = np.dtype({'names': [f[0] for f in FRAME_HEADER_FIELDS],
+                               'formats': [f[1:] if len(f) > 2 else f[1] for f in FRAME_HEADER_FIELDS],
+                               'itemsize': 1024})
+
+#Largest plausible time between two frames of a recording, in microseconds. Larger
+#jumps in sonartimestamp are treated as glitches.
+MAX_FRAME_GAP = 3600 * 1000000
+
 
 class ARIS_File:
     'This is a class container for the ARIS file headers'
@@ -97,6 +277,183 @@ class ARIS_File:
         print('Beam Count: ' + str(self.NumRawBeams))
         print('Samples/Beam: ' + str(self.SamplesPerChannel))
 
+    def frame_record_dtype(self):
+        """The dtype of one frame on disk: a FRAME_HEADER_DTYPE header followed by
+        the raw (samples, beams) uint8 sample block."""
+
+        return np.dtype([('header', FRAME_HEADER_DTYPE),
+                         ('samples', np.uint8, (self.SamplesPerChannel, self.NumRawBeams))])
+
+    def num_frames_on_disk(self):
+        """The number of complete frames in the file, computed from its size."""
+
+        return (os.path.getsize(self.filename) - 1024) // self.frame_record_dtype().itemsize
+
+    def map_frames(self):
+        """Memory map the frames of the file. After calling this, `frames` is a
+        (frames, samples, beams) uint8 view of the sample data (flipped the same
+        way as FrameRead) and `frame_headers` is a (frames,) view of the frame
+        headers with dtype FRAME_HEADER_DTYPE. Nothing is read from disk until the views are indexed,
+        so e.g. `crop_samples(frames[i], bin_range)` only reads the pages holding those bins.
+
+        The number of mapped frames is computed from the file size, so a
+        truncated final frame is ignored.
+        """
+
+        self.mmap = np.memmap(self.filename, dtype=self.frame_record_dtype(), mode='r', offset=1024,
+                              shape=(self.num_frames_on_disk(),))
+
+        self.frames = self.mmap['samples'][:, :, ::-1]
+        self.frame_headers = self.mmap['header']
+        #Frame -> whether its timestamp is out of place, see _out_of_place()
+        self._out_of_place_frames = {}
+
+        return self.frames
+
+    def _frame_timestamp(self, i):
+        """The sonartimestamp of frame i, reading only that frame's header."""
+
+        return int(self.frame_headers[i]['sonartimestamp'])
+
+    def _in_order(self, a, b):
+        """Whether the timestamps of frames a < b are plausible for one recording:
+        non-decreasing and at most MAX_FRAME_GAP apart."""
+
+        return 0 <= self._frame_timestamp(b) - self._frame_timestamp(a) <= MAX_FRAME_GAP
+
+    def _out_of_place(self, i):
+        """Whether the timestamp of frame i is out of order with most of the (up to)
+        six frames nearest to it. A few stray timestamps close together only
+        outvote each other, not the valid frames around them."""
+
+        if i not in self._out_of_place_frames:
+            num_frames = len(self.frame_headers)
+            start = min(max(i - 3, 0), max(num_frames - 7, 0))
+            neighbours = [j for j in range(start, min(start + 7, num_frames)) if j != i]
+
+            agree = sum(self._in_order(min(i, j), max(i, j)) for j in neighbours)
+            self._out_of_place_frames[i] = 2 * agree < len(neighbours)
+
+        return self._out_of_place_frames[i]
+
+    def _is_glitch(self, i, depth=2):
+        """Whether frame i has a glitched timestamp: it is out of place (see
+        _out_of_place()), or the nearest pair of frames around it (i - 1 and i + 1,
+        else i - 2 and i + 2, ...) that are in order does not bracket it. Frames
+        that are glitched themselves (checked `depth` levels deep, then only whether
+        they are out of place) are not used as a bracket."""
+
+        if self._out_of_place(i):
+            return True
+
+        def glitched(j):
+            return self._is_glitch(j, depth - 1) if depth > 0 else self._out_of_place(j)
+
+        ts = self._frame_timestamp(i)
+        for d in (1, 2, 3):
+            if i - d < 0 or i + d >= len(self.frame_headers):
+                break
+            if glitched(i - d) or glitched(i + d):
+                continue
+            before, after = self._frame_timestamp(i - d), self._frame_timestamp(i + d)
+            if before <= after:
+                return not (before <= ts <= after)
+
+        return False
+
+    def _timestamp_range(self):
+        """The first and last frames of the file that are not glitched (see
+        _is_glitch()), which skips glitched frames at either end of the file."""
+
+        if getattr(self, 'mmap', None) is None:
+            self.map_frames()
+
+        first, last = 0, len(self.frame_headers) - 1
+        while first <= last and self._is_glitch(first):
+            first += 1
+        while last > first and self._is_glitch(last):
+            last -= 1
+
+        return first, last
+
+    def _bisect_timestamp(self, ts, first, last, right=True):
+        """Binary search frames [first, last] for the position where `ts` would be
+        inserted to keep the timestamps sorted (after equal timestamps if `right`).
+
+        Glitched frames are stepped over: a probed frame is skipped if its timestamp
+        is outside of the ones bracketing the search (valid timestamps never
+        decrease) or out of order with its neighbours (see _is_glitch()).
+        """
+
+        lo, hi = first, last + 1
+        ts_lo, ts_hi = self._frame_timestamp(first), self._frame_timestamp(last)
+
+        def valid(i):
+            return ts_lo <= self._frame_timestamp(i) <= ts_hi and not self._is_glitch(i)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            probe = mid
+            while not valid(probe) and probe + 1 < hi:
+                probe += 1
+
+            if not valid(probe):
+                #Every frame in [mid, hi) is glitched
+                hi = mid
+                continue
+
+            probe_ts = self._frame_timestamp(probe)
+            if probe_ts < ts or (right and probe_ts == ts):
+                lo = probe + 1
+                ts_lo = probe_ts
+            else:
+                hi = mid
+                ts_hi = probe_ts
+
+        return lo
+
+    def frame_at_time(self, ts):
+        """Find the frame that covers a time, i.e. the last frame with a sonartimestamp
+        at or before `ts`. Only O(log n) frame headers are read.
+
+        Parameters
+        -----------
+        ts : (Int) Time in microseconds since epoch (the unit of sonartimestamp)
+
+        Returns
+        -------
+        frame : (Int) Index of the frame in the file (as used by FrameRead and
+            ARISReader), or None if `ts` is outside of the recording
+        """
+
+        first, last = self._timestamp_range()
+        if last < first or not (self._frame_timestamp(first) <= ts <= self._frame_timestamp(last)):
+            return None
+
+        return self._bisect_timestamp(ts, first, last) - 1
+
+    def frames_between(self, t0, t1):
+        """Find the frames with a sonartimestamp in [t0, t1] (microseconds since
+        epoch). Only O(log n) frame headers are read.
+
+        Returns
+        -------
+        frames : range of frame indices, e.g. `frames.start` and `frames.stop` are the
+            start_frame and (exclusive) end frame of a clip covering the time range
+        """
+
+        first, last = self._timestamp_range()
+        if last < first:
+            return range(0)
+
+        start, stop = self._bisect_timestamp(t0, first, last, right=False), self._bisect_timestamp(t1, first, last)
+        #Glitched frames just after t0 are not part of the range
+        while start < stop and self._is_glitch(start):
+            start += 1
+
+        return range(start, stop)
+
 class ARIS_Frame(ARIS_File):
     """This is a class container for the ARIS frame dataPI"""
 
@@ -285,7 +642,7 @@ class ARIS_Frame(ARIS_File):
 
     def info(self):
         print('Frame Number: ' + str(self.frameindex))
-        print('Frame Time: ' + str(datetime.datetime.fromtimestamp(self.sonartimestamp/1000000, pytz.timezone('UTC')).strftime('%Y-%m-%d %H:%M:%S.%f')))
+        print('Frame Time: ' + str(datetime.datetime.fromtimestamp(self.sonartimestamp/1000000, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')))
         print('Frame Rate: ' + str(self.framerate))
         print('Window Start: ' + str(self.windowstart))
         print('Window Length: ' + str(self.windowlength))
@@ -293,37 +650,10 @@ class ARIS_Frame(ARIS_File):
         print('Frequency: ' + str(self.frequencyhilow))
 
 
-def DataImport(filename, startFrame = 1, frameBuffer = 0):
-    """DataImport reads in the file specified by the filename.  The function populates
-    a ARIS_File data structure.  This function then calls the FrameRead() method
-    to load a starting frame.
-
-    Parameters
-    -----------
-    filename    : Input file (*.aris)
-    startFrame  : The first frame to be populated into the data structure
-    frameBuffer : This parameter is passed into the FrameRead method.  It adds a
-        specified number of pixels around the edges of the remapped frame.
-
-    Returns
-    -------
-    output_data : a ARIS_File data structure
-    frame : An ARIS_Frame data structure
-
-    Notes
-    -------
-    Basic frame attributes can be found by calling the file.info() method.
-    A list of all the frames attributes can be found by using dir(file), some
-        of these may or may not be used by the ARIS.
-    """
-
-    try:
-        data = open(filename, 'rb')
-    except:
-        print('File Error: An error occurred trying to read the file.')
-        raise
+def _read_file_header(data, filename):
+    """Parse the 1024 byte file header from an open file into an ARIS_File."""
 
-    #Start reading file header
+    data.seek(0, 0)
     version_number      = struct.unpack('I', data.read(4))[0]
     FrameCount          = struct.unpack('I', data.read(4))[0]
     FrameRate           = struct.unpack('I', data.read(4))[0]
@@ -373,11 +703,53 @@ def DataImport(filename, startFrame = 1, frameBuffer = 0):
                  Salinity, PulseLength, TxMode, VersionFGPA, VersionPSuC, ThumbnailFI, FileSize, OptionalHeaderSize, OptionalTailSize,
                  VersionMinor, LargeLens)
 
+    return output_data
+
+
+def DataImport(filename, startFrame = 1, frameBuffer = 0, memmap = False):
+    """DataImport reads in the file specified by the filename.  The function populates
+    a ARIS_File data structure.  This function then calls the FrameRead() method
+    to load a starting frame.
+
+    Parameters
+    -----------
+    filename    : Input file (*.aris)
+    startFrame  : The first frame to be populated into the data structure
+    frameBuffer : This parameter is passed into the FrameRead method.  It adds a
+        specified number of pixels around the edges of the remapped frame.
+    memmap      : If True, memory map the file so that all frames are available
+        through `output_data.frames` and `output_data.frame_headers`
+        (see ARIS_File.map_frames()).
+
+    Returns
+    -------
+    output_data : a ARIS_File data structure
+    frame : An ARIS_Frame data structure
+
+    Notes
+    -------
+    Basic frame attributes can be found by calling the file.info() method.
+    A list of all the frames attributes can be found by using dir(file), some
+        of these may or may not be used by the ARIS.
+    """
+
+    try:
+        data = open(filename, 'rb')
+    except:
+        print('File Error: An error occurred trying to read the file.')
+        raise
+
+    #Start reading file header
+    output_data = _read_file_header(data, filename)
+
     #Close data file
     data.close()
 
-    #Create an empty container for the lookup table
-    output_data.LUP = None
+    #The lookup table cache is shared by all files in the process
+    output_data.LUP = LUT_CACHE
+
+    if memmap:
+        output_data.map_frames()
 
     #Load the first frame
     frame = FrameRead(output_data, startFrame)
@@ -385,7 +757,107 @@ def DataImport(filename, startFrame = 1, frameBuffer = 0):
     #Return the data structure
     return output_data, frame
 
-def FrameRead(ARIS_data, frameIndex, frameBuffer = None):
+def _frame_from_header(header):
+    """Build an ARIS_Frame from a single FRAME_HEADER_DTYPE record."""
+
+    values = list(header.item())
+    values[FRAME_HEADER_DTYPE.names.index('tmatrix')] = array.array('f', header['tmatrix'])
+
+    return ARIS_Frame(*values)
+
+def _read_frame_header(data, ARIS_data, frameIndex, header_buf = None):
+    """Read the header of frame `frameIndex` from the open file `data` into an
+    ARIS_Frame (without frame_data). `header_buf` (a 1024 byte bytearray) is used
+    as scratch space when given."""
+
+    FrameSize = ARIS_data.NumRawBeams*ARIS_data.SamplesPerChannel
+
+    frameoffset = (1024+(frameIndex*(1024+(FrameSize))))
+
+    #A partial frame at the end of the file would decode as garbage
+    if frameIndex < 0 or frameoffset + 1024 + FrameSize > os.fstat(data.fileno()).st_size:
+        raise EOFError('Frame %d is past the end of %s' % (frameIndex, ARIS_data.filename))
+
+    data.seek(frameoffset, 0)
+    if header_buf is None:
+        header_buf = bytearray(1024)
+    if data.readinto(header_buf) != 1024:
+        raise EOFError('Frame %d is past the end of %s' % (frameIndex, ARIS_data.filename))
+    header = np.frombuffer(header_buf, dtype=FRAME_HEADER_DTYPE)[0]
+
+    #Create the ARIS_frame data structure and add the meta-data
+    output = _frame_from_header(header)
+    pingmode = output.pingmode
+
+    if pingmode in [1,2]:
+        ARIS_Frame.BeamCount = 48
+    if pingmode in [3,4,5]:
+        ARIS_Frame.BeamCount = 96
+    if pingmode in [6,7,8]:
+        ARIS_Frame.BeamCount = 64
+    if pingmode in [9,10,11,12]:
+        ARIS_Frame.BeamCount = 128
+
+    output.WinStart = output.samplestartdelay * 0.000001 * output.soundspeed / 2
+
+    return output
+
+
+def _bin_range(bin_range, num_bins):
+    """Clip a (start, stop) bin range (None for every bin) to the bins of a frame."""
+
+    if bin_range is None:
+        return 0, num_bins
+    start, stop = bin_range
+    start = min(max(start, 0), num_bins)
+    return start, min(max(stop, start), num_bins)
+
+
+def crop_samples(samples, bin_range = None, bin_step = 1, beam_step = 1):
+    """A view of the bins in `bin_range` ((start, stop), default every bin) of
+    (..., bins, beams) frame data, keeping every bin_step-th bin and every
+    beam_step-th beam. Works on memory mapped frames (ARIS_File.frames), in which
+    case only the cropped part of the frames is read from disk.
+    """
+
+    start, stop = _bin_range(bin_range, samples.shape[-2])
+
+    return samples[..., start:stop:bin_step, ::beam_step]
+
+
+def _read_frame(data, ARIS_data, frameIndex, out = None, header_buf = None, bin_range = None, bin_step = 1, beam_step = 1):
+    """Read frame `frameIndex` from the open file `data`. The samples are read
+    into `out` (a uint8 array with room for the whole frame) when given. Only the
+    bins in `bin_range` are read, and `frame_data` is decimated by `bin_step`
+    and `beam_step` (see crop_samples())."""
+
+    output = _read_frame_header(data, ARIS_data, frameIndex, header_buf)
+    bin_start, bin_stop = _bin_range(bin_range, output.samplesperbeam)
+    num_bins = bin_stop - bin_start
+
+    #Add the frame data, reading the sample block of the bin range in one go;
+    #fliplr only creates a view. The file is positioned right after the header.
+    if out is None or out.size < num_bins * ARIS_Frame.BeamCount:
+        out = np.empty(num_bins * ARIS_Frame.BeamCount, dtype=np.uint8)
+    frame = out.reshape(-1)[:num_bins * ARIS_Frame.BeamCount]
+    if bin_start > 0:
+        data.seek(bin_start * ARIS_Frame.BeamCount, 1)
+    if data.readinto(frame) != frame.size:
+        raise EOFError('Frame %d of %s is truncated' % (frameIndex, ARIS_data.filename))
+    frame = frame.reshape(num_bins, ARIS_Frame.BeamCount)
+    frame = np.fliplr(frame)[::bin_step, ::beam_step]
+
+    #Remap the data from 0-255 to 0-80 dB
+    #remap = lambda t: (t * 80)/255
+    #vfunc = np.vectorize(remap)
+    #frame = vfunc(frame)
+
+    output.frame_data = frame
+
+    return output
+
+
+def FrameRead(ARIS_data, frameIndex, frameBuffer = None, bin_range = None, bin_step = 1, beam_step = 1):
     """The FrameRead function loads in the specified frame data from the raw ARIS data.
     The function then calls the remapARIS() function which remaps the raw data into
     a 2D real world projection.
@@ -396,11 +868,19 @@ def FrameRead(ARIS_data, frameIndex, frameBuffer = None):
     frameIndex : frame number
     frameBuffer : This parameter add a specified number of pixels around the edges
                     of the remapped frame.
+    bin_range : (Optional) (start, stop) range of bins to read. Only these bins
+        are read from disk.
+    bin_step, beam_step : (Int) Keep every bin_step-th bin and beam_step-th beam
+        (see crop_samples() and crop_sample_mapping())
 
     Returns
     -------
     output : a frame data structure
 
+    Raises
+    -------
+    EOFError : if the frame is not completely contained in the file
+
     Notes
     -------
     Basic frame attributes can be found by calling the frame.info() method.
@@ -408,233 +888,206 @@ def FrameRead(ARIS_data, frameIndex, frameBuffer = None):
         of these may or may not be used by the ARIS.
     """
 
-    FrameSize = ARIS_data.NumRawBeams*ARIS_data.SamplesPerChannel
+    #The data file is closed even if the frame can not be read
+    with open(ARIS_data.filename, 'rb') as data:
+        output = _read_frame(data, ARIS_data, frameIndex, bin_range = bin_range, bin_step = bin_step, beam_step = beam_step)
 
-    frameoffset = (1024+(frameIndex*(1024+(FrameSize))))
+    return output
 
-    data = open(ARIS_data.filename, 'rb')
-    data.seek(frameoffset, 0)
 
-    frameindex          = struct.unpack('I', data.read(4))[0] #Frame number in file
-    frametime           = struct.unpack('Q', data.read(8))[0] #PC time stamp when recorded; microseconds since epoch (Jan 1st 1970)
-    version             = struct.unpack('I', data.read(4))[0] #ARIS file format version = 0x05464444
-    status              = struct.unpack('I', data.read(4))[0]
-    sonartimestamp      = struct.unpack('Q', data.read(8))[0] #On-sonar microseconds since epoch (Jan 1st 1970)
-    tsday               = struct.unpack('I', data.read(4))[0]
-    tshour              = struct.unpack('I', data.read(4))[0]
-    tsminute            = struct.unpack('I', data.read(4))[0]
-    tssecond            = struct.unpack('I', data.read(4))[0]
-    tshsecond           = struct.unpack('I', data.read(4))[0]
-    transmitmode        = struct.unpack('I', data.read(4))[0]
-    windowstart         = struct.unpack('f', data.read(4))[0] #Window start in meters
-    windowlength        = struct.unpack('f', data.read(4))[0] #Window length in meters
-    threshold           = struct.unpack('I', data.read(4))[0]
-    intensity           = struct.unpack('i', data.read(4))[0]
-    receivergain        = struct.unpack('I', data.read(4))[0] #Note: 0-24 dB
-    degc1               = struct.unpack('I', data.read(4))[0] #CPU temperature (C)
-    degc2               = struct.unpack('I', data.read(4))[0] #Power supply temperature (C)
-    humidity            = struct.unpack('I', data.read(4))[0] #% relative humidity
-    focus               = struct.unpack('I', data.read(4))[0] #Focus units 0-1000
-    battery             = struct.unpack('I', data.read(4))[0] #OBSOLETE: Unused.
-    uservalue1          = struct.unpack('f', data.read(4))[0]
-    uservalue2          = struct.unpack('f', data.read(4))[0]
-    uservalue3          = struct.unpack('f', data.read(4))[0]
-    uservalue4          = struct.unpack('f', data.read(4))[0]
-    uservalue5          = struct.unpack('f', data.read(4))[0]
-    uservalue6          = struct.unpack('f', data.read(4))[0]
-    uservalue7          = struct.unpack('f', data.read(4))[0]
-    uservalue8          = struct.unpack('f', data.read(4))[0]
-    velocity            = struct.unpack('f', data.read(4))[0] # Platform velocity from AUV integration
-    depth               = struct.unpack('f', data.read(4))[0] # Platform depth from AUV integration
-    altitude            = struct.unpack('f', data.read(4))[0] # Platform altitude from AUV integration
-    pitch               = struct.unpack('f', data.read(4))[0] # Platform pitch from AUV integration
-    pitchrate           = struct.unpack('f', data.read(4))[0] # Platform pitch rate from AUV integration
-    roll                = struct.unpack('f', data.read(4))[0] # Platform roll from AUV integration
-    rollrate            = struct.unpack('f', data.read(4))[0] # Platform roll rate from AUV integration
-    heading             = struct.unpack('f', data.read(4))[0] # Platform heading from AUV integration
-    headingrate         = struct.unpack('f', data.read(4))[0] # Platform heading rate from AUV integration
-    compassheading      = struct.unpack('f', data.read(4))[0] # Sonar compass heading output
-    compasspitch        = struct.unpack('f', data.read(4))[0] # Sonar compass pitch output
-    compassroll         = struct.unpack('f', data.read(4))[0] # Sonar compass roll output
-    latitude            = struct.unpack('d', data.read(8))[0] # from auxiliary GPS sensor
-    longitude           = struct.unpack('d', data.read(8))[0] # from auxiliary GPS sensor
-    sonarposition       = struct.unpack('f', data.read(4))[0] # special for PNNL
-    configflags         = struct.unpack('I', data.read(4))[0]
-    beamtilt            = struct.unpack('f', data.read(4))[0]
-    targetrange         = struct.unpack('f', data.read(4))[0]
-    targetbearing       = struct.unpack('f', data.read(4))[0]
-    targetpresent       = struct.unpack('I', data.read(4))[0]
-    firmwarerevision    = struct.unpack('I', data.read(4))[0] #OBSOLETE: Unused.
-    flags               = struct.unpack('I', data.read(4))[0]
-    sourceframe         = struct.unpack('I', data.read(4))[0] # Source file frame number for CSOT output files
-    watertemp           = struct.unpack('f', data.read(4))[0] # Water temperature from housing temperature sensor
-    timerperiod         = struct.unpack('I', data.read(4))[0]
-    sonarx              = struct.unpack('f', data.read(4))[0] # Sonar X location for 3D processing
-    sonary              = struct.unpack('f', data.read(4))[0] # Sonar Y location for 3D processing
-    sonarz              = struct.unpack('f', data.read(4))[0] # Sonar Z location for 3D processing
-    sonarpan            = struct.unpack('f', data.read(4))[0] # X2 pan output
-    sonartilt           = struct.unpack('f', data.read(4))[0] # X2 tilt output
-    sonarroll           = struct.unpack('f', data.read(4))[0] # X2 roll output                                                                                                                       **** End of DDF_03 frame header data ****
-    panpnnl             = struct.unpack('f', data.read(4))[0]
-    tiltpnnl            = struct.unpack('f', data.read(4))[0]
-    rollpnnl            = struct.unpack('f', data.read(4))[0]
-    vehicletime         = struct.unpack('d', data.read(8))[0] # special for Bluefin Robotics HAUV or other AUV integration
-    timeggk             = struct.unpack('f', data.read(4))[0] # GPS output from NMEA GGK message
-    dateggk             = struct.unpack('I', data.read(4))[0] # GPS output from NMEA GGK message
-    qualityggk          = struct.unpack('I', data.read(4))[0] # GPS output from NMEA GGK message
-    numsatsggk          = struct.unpack('I', data.read(4))[0] # GPS output from NMEA GGK message
-    dopggk              = struct.unpack('f', data.read(4))[0] # GPS output from NMEA GGK message
-    ehtggk              = struct.unpack('f', data.read(4))[0] # GPS output from NMEA GGK message
-    heavetss            = struct.unpack('f', data.read(4))[0] # external sensor
-    yeargps             = struct.unpack('I', data.read(4))[0] # GPS year output
-    monthgps            = struct.unpack('I', data.read(4))[0] # GPS month output
-    daygps              = struct.unpack('I', data.read(4))[0] # GPS day output
-    hourgps             = struct.unpack('I', data.read(4))[0] # GPS hour output
-    minutegps           = struct.unpack('I', data.read(4))[0] # GPS minute output
-    secondgps           = struct.unpack('I', data.read(4))[0] # GPS second output
-    hsecondgps          = struct.unpack('I', data.read(4))[0] # GPS 1/100th second output
-    sonarpanoffset      = struct.unpack('f', data.read(4))[0] # Sonar mount location pan offset for 3D processing
-    sonartiltoffset     = struct.unpack('f', data.read(4))[0] # Sonar mount location tilt offset for 3D processing
-    sonarrolloffset     = struct.unpack('f', data.read(4))[0] # Sonar mount location roll offset for 3D processing
-    sonarxoffset        = struct.unpack('f', data.read(4))[0] # Sonar mount location X offset for 3D processing
-    sonaryoffset        = struct.unpack('f', data.read(4))[0] # Sonar mount location Y offset for 3D processing
-    sonarzoffset        = struct.unpack('f', data.read(4))[0] # Sonar mount location Z offset for 3D processing
-    tmatrix = array.array('f')                                # 3D processing transformation matrix
-    for i in range(16):
-        tmatrix.append(struct.unpack('f', data.read(4))[0])
-    samplerate          = struct.unpack('f', data.read(4))[0] # Calculated as 1e6/SamplePeriod
-    accellx             = struct.unpack('f', data.read(4))[0] # X-axis sonar acceleration
-    accelly             = struct.unpack('f', data.read(4))[0] # Y-axis sonar acceleration
-    accellz             = struct.unpack('f', data.read(4))[0] # Z-axis sonar acceleration
-    pingmode            = struct.unpack('I', data.read(4))[0] # ARIS ping mode [1..12]
-    frequencyhilow      = struct.unpack('I', data.read(4))[0] # 1 = HF, 0 = LF
-    pulsewidth          = struct.unpack('I', data.read(4))[0] # Width of transmit pulse in usec, [4..100]
-    cycleperiod         = struct.unpack('I', data.read(4))[0] # Ping cycle time in usec, [1802..65535]
-    sampleperiod        = struct.unpack('I', data.read(4))[0] # Downrange sample rate in usec, [4..100]
-    transmitenable      = struct.unpack('I', data.read(4))[0] # 1 = Transmit ON, 0 = Transmit OFF
-    framerate           = struct.unpack('f', data.read(4))[0] # Instantaneous frame rate between frame N and frame N-1
-    soundspeed          = struct.unpack('f', data.read(4))[0] # Sound velocity in water calculated from water temperature and salinity setting
-    samplesperbeam      = struct.unpack('I', data.read(4))[0] # Number of downrange samples in each beam
-    enable150v          = struct.unpack('I', data.read(4))[0] # 1 = 150V ON (Max Power), 0 = 150V OFF (Min Power, 12V)
-    samplestartdelay    = struct.unpack('I', data.read(4))[0] # Delay from transmit until start of sampling (window start) in usec, [930..65535]
-    largelens           = struct.unpack('I', data.read(4))[0] # 1 = telephoto lens (large lens, big lens, hi-res lens) present
-    thesystemtype       = struct.unpack('I', data.read(4))[0] # 1 = ARIS 3000, 0 = ARIS 1800, 2 = ARIS 1200
-    sonarserialnumber   = struct.unpack('I', data.read(4))[0] # Sonar serial number as labeled on housing
-    encryptedkey        = struct.unpack('Q', data.read(8))[0] # Reserved for future use
-    ariserrorflagsuint  = struct.unpack('I', data.read(4))[0] # Error flag code bits
-    missedpackets       = struct.unpack('I', data.read(4))[0] # Missed packet count for Ethernet statistics reporting
-    arisappversion      = struct.unpack('I', data.read(4))[0] # Version number of ArisApp sending frame data
-    available2          = struct.unpack('I', data.read(4))[0] # Reserved for future use
-    reorderedsamples    = struct.unpack('I', data.read(4))[0] # 1 = frame data already ordered into [beam,sample] array, 0 = needs reordering
-    salinity            = struct.unpack('I', data.read(4))[0] # Water salinity code:  0 = fresh, 15 = brackish, 35 = salt
-    pressure            = struct.unpack('f', data.read(4))[0] # Depth sensor output in meters (psi)
-    batteryvoltage      = struct.unpack('f', data.read(4))[0] # Battery input voltage before power steering
-    mainvoltage         = struct.unpack('f', data.read(4))[0] # Main cable input voltage before power steering
-    switchvoltage       = struct.unpack('f', data.read(4))[0] # Input voltage after power steering
-    focusmotormoving    = struct.unpack('I', data.read(4))[0] # Added 14-Aug-2012 for AutomaticRecording
-    voltagechanging     = struct.unpack('I', data.read(4))[0] # Added 16-Aug (first two bits = 12V, second two bits = 150V, 00 = not changing, 01 = turning on, 10 = turning off)
-    focustimeoutfault   = struct.unpack('I', data.read(4))[0]
-    focusovercurrentfault = struct.unpack('I', data.read(4))[0]
-    focusnotfoundfault  = struct.unpack('I', data.read(4))[0]
-    focusstalledfault   = struct.unpack('I', data.read(4))[0]
-    fpgatimeoutfault    = struct.unpack('I', data.read(4))[0]
-    fpgabusyfault       = struct.unpack('I', data.read(4))[0]
-    fpgastuckfault      = struct.unpack('I', data.read(4))[0]
-    cputempfault        = struct.unpack('I', data.read(4))[0]
-    psutempfault        = struct.unpack('I', data.read(4))[0]
-    watertempfault      = struct.unpack('I', data.read(4))[0]
-    humidityfault       = struct.unpack('I', data.read(4))[0]
-    pressurefault       = struct.unpack('I', data.read(4))[0]
-    voltagereadfault    = struct.unpack('I', data.read(4))[0]
-    voltagewritefault   = struct.unpack('I', data.read(4))[0]
-    focuscurrentposition = struct.unpack('I', data.read(4))[0] # Focus shaft current position in motor units [0.1000]
-    targetpan           = struct.unpack('f', data.read(4))[0] # Commanded pan position
-    targettilt          = struct.unpack('f', data.read(4))[0] # Commanded tilt position
-    targetroll          = struct.unpack('f', data.read(4))[0] # Commanded roll position
-    panmotorerrorcode   = struct.unpack('I', data.read(4))[0]
-    tiltmotorerrorcode  = struct.unpack('I', data.read(4))[0]
-    rollmotorerrorcode  = struct.unpack('I', data.read(4))[0]
-    panabsposition      = struct.unpack('f', data.read(4))[0] # Low-resolution magnetic encoder absolute pan position
-    tiltabsposition     = struct.unpack('f', data.read(4))[0] # Low-resolution magnetic encoder absolute tilt position
-    rollabsposition     = struct.unpack('f', data.read(4))[0] # Low-resolution magnetic encoder absolute roll position
-    panaccelx           = struct.unpack('f', data.read(4))[0] # Accelerometer outputs from AR2 CPU board sensor
-    panaccely           = struct.unpack('f', data.read(4))[0]
-    panaccelz           = struct.unpack('f', data.read(4))[0]
-    tiltaccelx          = struct.unpack('f', data.read(4))[0]
-    tiltaccely          = struct.unpack('f', data.read(4))[0]
-    tiltaccelz          = struct.unpack('f', data.read(4))[0]
-    rollaccelx          = struct.unpack('f', data.read(4))[0]
-    rollaccely          = struct.unpack('f', data.read(4))[0]
-    rollaccelz          = struct.unpack('f', data.read(4))[0]
-    appliedsettings     = struct.unpack('I', data.read(4))[0] # Cookie indices for command acknowlege in frame header
-    constrainedsettings = struct.unpack('I', data.read(4))[0]
-    invalidsettings     = struct.unpack('I', data.read(4))[0]
-    enableinterpacketdelay = struct.unpack('I', data.read(4))[0] # If true delay is added between sending out image data packets
-    interpacketdelayperiod = struct.unpack('I', data.read(4))[0] # packet delay factor in us (does not include function overhead time)
-    uptime              = struct.unpack('I', data.read(4))[0] # Total number of seconds sonar has been running
-    arisappversionmajor = struct.unpack('H', data.read(2))[0] # Major version number
-    arisappversionminor = struct.unpack('H', data.read(2))[0] # Minor version number
-    gotime              = struct.unpack('Q', data.read(8))[0] # Sonar time when frame cycle is initiated in hardware
-    panvelocity         = struct.unpack('f', data.read(4))[0] # AR2 pan velocity in degrees/second
-    tiltvelocity        = struct.unpack('f', data.read(4))[0] # AR2 tilt velocity in degrees/second
-    rollvelocity        = struct.unpack('f', data.read(4))[0] # AR2 roll velocity in degrees/second
-    sentinel            = struct.unpack('I', data.read(4))[0] # Used to measure the frame header size
+def read_frame_headers(ARIS_data, start = 0, end = None):
+    """Decode the headers of a range of frames into a structured array with one
+    column per header field (see FRAME_HEADER_DTYPE), e.g.
+    `read_frame_headers(data)['sonartimestamp']`.
 
-    #Create the ARIS_frame data structure and add the meta-data
-    output = ARIS_Frame(frameindex, frametime, version, status, sonartimestamp, tsday, tshour, tsminute, tssecond, tshsecond, transmitmode,
-                 windowstart, windowlength, threshold, intensity, receivergain, degc1, degc2, humidity, focus, battery, uservalue1, uservalue2,
-                 uservalue3,  uservalue4,  uservalue5, uservalue6, uservalue7, uservalue8,  velocity, depth, altitude, pitch, pitchrate, roll,
-                 rollrate, heading, headingrate, compassheading, compasspitch, compassroll, latitude, longitude, sonarposition, configflags,
-                 beamtilt, targetrange, targetbearing, targetpresent, firmwarerevision, flags, sourceframe, watertemp, timerperiod, sonarx,
-                 sonary, sonarz, sonarpan, sonartilt, sonarroll, panpnnl, tiltpnnl, rollpnnl, vehicletime, timeggk, dateggk, qualityggk, numsatsggk,
-                 dopggk, ehtggk, heavetss, yeargps, monthgps, daygps, hourgps, minutegps, secondgps, hsecondgps, sonarpanoffset, sonartiltoffset,
-                 sonarrolloffset, sonarxoffset, sonaryoffset, sonarzoffset, tmatrix, samplerate, accellx, accelly, accellz, pingmode, frequencyhilow,
-                 pulsewidth, cycleperiod, sampleperiod, transmitenable, framerate, soundspeed, samplesperbeam, enable150v, samplestartdelay, largelens,
-                 thesystemtype, sonarserialnumber, encryptedkey, ariserrorflagsuint, missedpackets, arisappversion, available2, reorderedsamples,
-                 salinity, pressure, batteryvoltage, mainvoltage, switchvoltage, focusmotormoving, voltagechanging, focustimeoutfault, focusovercurrentfault,
-                 focusnotfoundfault, focusstalledfault, fpgatimeoutfault, fpgabusyfault, fpgastuckfault, cputempfault, psutempfault, watertempfault,
-                 humidityfault, pressurefault, voltagereadfault, voltagewritefault, focuscurrentposition, targetpan, targettilt, targetroll, panmotorerrorcode,
-                 tiltmotorerrorcode, rollmotorerrorcode, panabsposition, tiltabsposition, rollabsposition, panaccelx, panaccely, panaccelz, tiltaccelx,
-                 tiltaccely, tiltaccelz, rollaccelx, rollaccely, rollaccelz, appliedsettings, constrainedsettings, invalidsettings, enableinterpacketdelay,
-                 interpacketdelayperiod, uptime, arisappversionmajor, arisappversionminor, gotime, panvelocity, tiltvelocity, rollvelocity, sentinel)
+    Only the header bytes of each frame are touched; the sample data is skipped.
 
+    Parameters
+    -----------
+    ARIS_data : ARIS data structure returned via pyARIS.DataImport()
+    start, end : (Int) Range of frames to decode. Default is every frame.
 
-    #Add the frame data
-    if pingmode in [1,2]:
-        ARIS_Frame.BeamCount = 48
-    if pingmode in [3,4,5]:
-        ARIS_Frame.BeamCount = 96
-    if pingmode in [6,7,8]:
-        ARIS_Frame.BeamCount = 64
-    if pingmode in [9,10,11,12]:
-        ARIS_Frame.BeamCount = 128
+    Returns
+    -------
+    headers : numpy structured array with dtype FRAME_HEADER_DTYPE
+    """
 
-    data.seek(frameoffset+1024, 0)
-    frame = np.empty([samplesperbeam, ARIS_Frame.BeamCount], dtype=float)
-    for r in range(len(frame)):
-        for c in range(len(frame[r])):
-            frame[r][c] = struct.unpack('B', data.read(1))[0]
-    frame = np.fliplr(frame)
+    if getattr(ARIS_data, 'mmap', None) is None:
+        ARIS_data.map_frames()
 
-    #Remap the data from 0-255 to 0-80 dB
-    #remap = lambda t: (t * 80)/255
-    #vfunc = np.vectorize(remap)
-    #frame = vfunc(frame)
+    return np.array(ARIS_data.frame_headers[start:end])
 
-    output.frame_data = frame
-    output.WinStart = output.samplestartdelay * 0.000001 * output.soundspeed / 2
 
-    #Close the data file
-    data.close()
+class ARISReader:
+    """Reader for an ARIS file that keeps a single file handle open across reads.
 
-    return output
+    read_frame() and read_header() have the same semantics as FrameRead(), but
+    the file is only opened once and the header scratch buffer is reused.
 
+    Example
+    -------
+    >>> with pyARIS.ARISReader('file.aris') as reader:
+    ...     for i in range(len(reader)):
+    ...         frame = reader.read_frame(i)
+    """
 
-def get_box_for_sample(beam_num, bin_num, frame, beam_data):
-    """ Get the box coordinates (in meters) for a sample.
-    This is a non-axis aligned box.
+    def __init__(self, filename):
+        try:
+            self.handle = open(filename, 'rb')
+        except:
+            print('File Error: An error occurred trying to read the file.')
+            raise
+
+        self.data = _read_file_header(self.handle, filename)
+        self.data.LUP = LUT_CACHE
+        self._header_buf = bytearray(1024)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return 'ARIS Reader: ' + self.data.filename
+
+    def close(self):
+        self.handle.close()
+
+    def read_header(self, frameIndex):
+        """Read only the header of a frame. Returns an ARIS_Frame without frame_data."""
+        return _read_frame_header(self.handle, self.data, frameIndex, self._header_buf)
+
+    def read_frame(self, frameIndex, out = None, bin_range = None, bin_step = 1, beam_step = 1):
+        """Read a frame (header and samples), like FrameRead().
+
+        Parameters
+        -----------
+        frameIndex : frame number
+        out : (Optional) contiguous uint8 array with room for a whole frame. The
+            samples are read into this array, so `frame_data` is only valid until
+            `out` is reused. A new array is allocated if `out` is not given or is
+            too small.
+        bin_range, bin_step, beam_step : (Optional) Read part of the frame, as in FrameRead()
+        """
+        return _read_frame(self.handle, self.data, frameIndex, out, self._header_buf, bin_range, bin_step, beam_step)
+
+    def read_records(self, start, count, bin_range = None, bin_step = 1, beam_step = 1):
+        """Read `count` consecutive frames starting at `start` with a single read.
+
+        If `bin_range`, `bin_step` or `beam_step` are given, the frames are copied out
+        of a memory map of the file instead (see crop_samples()), so only the
+        pages holding the bin range are read.
+
+        Returns
+        -------
+        frames : (count, samples, beams) uint8 array, flipped like FrameRead()
+        headers : (count,) array with dtype FRAME_HEADER_DTYPE
+        """
+        if bin_range is not None or bin_step != 1 or beam_step != 1:
+            if getattr(self.data, 'mmap', None) is None:
+                self.data.map_frames()
+            frames = crop_samples(self.data.frames[start:start + count], bin_range, bin_step, beam_step)
+            return np.ascontiguousarray(frames), np.array(self.data.frame_headers[start:start + count])
+
+        record = self.data.frame_record_dtype()
+        records = np.empty(count, dtype=record)
+
+        self.handle.seek(1024 + start * record.itemsize, 0)
+        num_read = self.handle.readinto(records.view(np.uint8)) // record.itemsize
+        records = records[:num_read]
+
+        return records['samples'][:, :, ::-1], records['header']
+
+    def iter_frames(self, start = 0, end = None, batch_size = 32, prefetch = 2, bin_range = None, bin_step = 1, beam_step = 1):
+        """Iterate over frames in order, in batches, while a background thread
+        reads ahead.
+
+        Parameters
+        -----------
+        start, end : (Int) Range of frames to read. `end` defaults to the last frame on disk.
+        batch_size : (Int) Number of frames per batch
+        prefetch : (Int) Maximum number of batches read ahead of the consumer. At
+            most `prefetch` + 2 batches are held in memory at once.
+        bin_range, bin_step, beam_step : (Optional) Read part of every frame (see read_records())
+
+        Yields
+        -------
+        frames, headers : as returned by read_records()
+
+        Notes
+        -------
+        The background thread uses its own file handle, so the reader can still be
+        used for random access while iterating. `prefetch_stats` is updated as
+        the iteration runs. It counts the batches yielded, the `stalls` (batches
+        the consumer had to wait for) and the total `stall_time` in seconds.
+        """
+
+        if end is None:
+            end = self.data.num_frames_on_disk()
+        end = min(end, self.data.num_frames_on_disk())
+
+        batches = queue.Queue(maxsize=max(prefetch, 1))
+        stop = threading.Event()
+
+        def put(item):
+            #Give up once the consumer has stopped, so the thread can always be joined
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def producer():
+            try:
+                with ARISReader(self.data.filename) as reader:
+                    for batch_start in range(start, end, batch_size):
+                        batch = reader.read_records(batch_start, min(batch_size, end - batch_start), bin_range, bin_step, beam_step)
+                        if not put(batch):
+                            return
+            except Exception as e:
+                put(e)
+                return
+            put(None)
+
+        self.prefetch_stats = {'batches': 0, 'stalls': 0, 'stall_time': 0.}
+
+        thread = threading.Thread(target=producer, daemon=True)
+        thread.start()
+        try:
+            while True:
+                try:
+                    batch = batches.get_nowait()
+                except queue.Empty:
+                    wait_start = time.perf_counter()
+                    batch = batches.get()
+                    self.prefetch_stats['stalls'] += 1
+                    self.prefetch_stats['stall_time'] += time.perf_counter() - wait_start
+
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+
+                self.prefetch_stats['batches'] += 1
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
+
+
+def get_boxes_for_samples(beam_nums, bin_nums, frame, beam_data):
+    """ Get the box coordinates (in meters) for many samples at once.
+    `beam_nums` and `bin_nums` are broadcast against each other, so e.g.
+    `get_boxes_for_samples(np.arange(frame.BeamCount)[np.newaxis, :], np.arange(frame.samplesperbeam)[:, np.newaxis], ...)`
+    gives the footprint of every sample in a frame.
     Returns:
-        back left, back right, front right, front left
+        back left, back right, front right, front left : arrays of shape (..., 2) holding (x, y)
     """
 
     sample_start_delay = frame.samplestartdelay # usec
@@ -644,43 +1097,38 @@ def get_box_for_sample(beam_num, bin_num, frame, beam_data):
     WindowStart = sample_start_delay * 1e-6 * sound_speed / 2 # meters
     sample_length = sample_period * 1e-6 * sound_speed / 2. # meters
 
-    bin_front_edge_distance = WindowStart + sample_length * bin_num
-    bin_back_edge_distance = WindowStart + sample_length* (bin_num + 1)
+    bin_nums = np.asarray(bin_nums)
+    bin_front_edge_distance = WindowStart + sample_length * bin_nums
+    bin_back_edge_distance = WindowStart + sample_length* (bin_nums + 1)
 
-    beam_angles = beam_data[beam_data['beam_num'] == beam_num]
-    a1 = beam_angles['beam_left'].iloc[0]
-    a2 = beam_angles['beam_right'].iloc[0]
-    c = beam_angles['beam_center'].iloc[0]
+    # The beam width tables are indexed by beam number
+    beam_nums = np.asarray(beam_nums).astype(np.int64)
+    a1 = np.asarray(beam_data['beam_left'])[beam_nums]
+    a2 = np.asarray(beam_data['beam_right'])[beam_nums]
 
     # I can't figure out whats going on with the beam spacing in the files.
     # Once the center point crosses 0, the ordering of the left and right angles swap...
     # For now I'll assume the y axis is the common line. Positive angles go to the left,
     # negative angles go to the right
-    left = max(a1, a2)
-    right = min(a1, a2)
-
-    # Left Edge
-    beam_left_angle = np.deg2rad(left)
-    rot_matrix = np.array([[np.cos(beam_left_angle), -np.sin(beam_left_angle)], [np.sin(beam_left_angle), np.cos(beam_left_angle)]])
+    beam_left_angle = np.deg2rad(np.maximum(a1, a2))
+    beam_right_angle = np.deg2rad(np.minimum(a1, a2))
 
-    vec = np.array([0, bin_back_edge_distance])
-    bin_left_back_point = np.matmul(rot_matrix, vec)
+    # Rotating (0, distance) by an angle gives (-sin(angle) * distance, cos(angle) * distance)
+    def rotate(angle, distance):
+        return np.stack(np.broadcast_arrays(-np.sin(angle) * distance, np.cos(angle) * distance), axis=-1)
 
-    vec = np.array([0, bin_front_edge_distance])
-    bin_left_front_point = np.matmul(rot_matrix, vec)
+    return (rotate(beam_left_angle, bin_back_edge_distance), rotate(beam_right_angle, bin_back_edge_distance),
+            rotate(beam_right_angle, bin_front_edge_distance), rotate(beam_left_angle, bin_front_edge_distance))
 
-    # Right Edge
-    beam_right_angle = np.deg2rad(right)
-    rot_matrix = np.array([[np.cos(beam_right_angle), -np.sin(beam_right_angle)], [np.sin(beam_right_angle), np.cos(beam_right_angle)]])
-
-    vec = np.array([0, bin_front_edge_distance])
-    bin_right_front_point = np.matmul(rot_matrix, vec)
-
-    vec = np.array([0, bin_back_edge_distance])
-    bin_right_back_point = np.matmul(rot_matrix, vec)
 
+def get_box_for_sample(beam_num, bin_num, frame, beam_data):
+    """ Get the box coordinates (in meters) for a sample.
+    This is a non-axis aligned box.
+    Returns:
+        back left, back right, front right, front left
+    """
 
-    return bin_left_back_point, bin_right_back_point, bin_right_front_point, bin_left_front_point
+    return get_boxes_for_samples(beam_num, bin_num, frame, beam_data)
 
 
 def xy_to_sample(x, y, frame, beam_data):
@@ -688,20 +1136,43 @@ def xy_to_sample(x, y, frame, beam_data):
     Returns:
         beam num
         bin num
+        (None, None if the location is outside of the sonar fan)
     """
 
-    # Get the angle
-    angle = np.rad2deg(np.arctan(x / y))
-
-    beam_num = beam_data[(beam_data['beam_left'] <= angle) & (angle <= beam_data['beam_right'])]
+    beam_num, bin_num = xy_to_samples(x, y, frame, beam_data)
 
-    if beam_num.shape[0] == 0:
+    if beam_num < 0:
         return None, None
 
-    beam_num = beam_num['beam_num'].iloc[0]
+    return int(beam_num), int(bin_num)
 
-    # Get the distance
-    hyp =  y / np.cos(np.arctan(x / y))
+
+def xy_to_samples(x, y, frame, beam_data):
+    """ Convert arrays of x,y locations (in meters) to beam samples.
+    Locations are assigned to samples with the same rule that is used to build the
+    image (see compute_mapping_from_sample_to_image()): beam n covers the angles
+    [beam_left[n], beam_left[n + 1]) and bin k covers the distances
+    [WinStart + k * bin_length, WinStart + (k + 1) * bin_length).
+
+    Parameters
+    -----------
+    x, y : arrays (or scalars) of locations in meters, broadcast against each other
+    frame : ARIS_Frame that provides the window settings
+    beam_data : beam width table of the frame
+
+    Returns
+    -------
+    beam_nums, bin_nums : int32 arrays with the broadcast shape of x and y. Locations
+        outside of the sonar fan (including NaN locations) are -1 in both arrays.
+    """
+
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+
+    # Get the angle and the distance
+    with np.errstate(divide='ignore', invalid='ignore'):
+        theta = np.arctan(x / y)
+        hyp = y / np.cos(theta)
+    angles = np.rad2deg(theta)
 
     # Take into account the window start
     hyp -= frame.WinStart
@@ -709,41 +1180,131 @@ def xy_to_sample(x, y, frame, beam_data):
     # Sample length
     bin_length = frame.sampleperiod * 0.000001 * frame.soundspeed / 2.
 
-    # Convert to bins
-    bin_num = int(hyp / bin_length)
+    # Convert to (fractional) bins
+    bins = hyp / bin_length
 
-    if bin_num < 0 or bin_num > (frame.BeamCount - 1):
-        return None, None
+    # Bins are truncated towards 0, so anything above -1 falls into bin 0
+    beam_edges = np.asarray(beam_data['beam_left'])
+    valid = ((y > 0) & (angles > np.min(beam_edges)) & (angles < np.max(beam_data['beam_right'])) &
+             (bins > -1) & (bins < frame.samplesperbeam))
 
-    return beam_num, bin_num
+    beam_nums = np.full(x.shape, -1, dtype=np.int32)
+    bin_nums = np.full(x.shape, -1, dtype=np.int32)
+    beam_nums[valid] = np.searchsorted(beam_edges, angles[valid], side='right') - 1
+    bin_nums[valid] = bins[valid].astype(np.int32)
 
+    return beam_nums, bin_nums
 
-def get_minimum_pixel_meter_size(frame, beam_width_data):
-    """ Compute the smallest pixel size that will bound a sample.
+
+def samples_to_xy(beam_nums, bin_nums, frame, beam_data):
+    """ Convert arrays of beam samples to x,y locations (in meters), the inverse of
+    xy_to_samples(). A sample is placed at the middle of the angles and distances
+    that xy_to_samples() assigns to it, so that
+    `xy_to_samples(*samples_to_xy(beam_nums, bin_nums, ...), ...)` gives back the samples.
+
+    Parameters
+    -----------
+    beam_nums, bin_nums : integer arrays (or scalars), broadcast against each other
+    frame : ARIS_Frame that provides the window settings
+    beam_data : beam width table of the frame
+
+    Returns
+    -------
+    x, y : float64 arrays with the broadcast shape of beam_nums and bin_nums. Samples
+        outside of the frame (e.g. the -1 returned by xy_to_samples()) are NaN.
     """
 
-    all_widths = []
-    all_heights = []
+    beam_nums, bin_nums = np.broadcast_arrays(np.asarray(beam_nums), np.asarray(bin_nums))
+
+    beam_edges = np.asarray(beam_data['beam_left'], dtype=np.float64)
+    beam_edges = np.append(beam_edges, np.max(beam_data['beam_right']))
+    num_beams = beam_edges.shape[0] - 1
+
+    valid = (beam_nums >= 0) & (beam_nums < num_beams) & (bin_nums >= 0) & (bin_nums < frame.samplesperbeam)
+    beam_nums = np.where(valid, beam_nums, 0)
+
+    # Middle of the beam and of the bin
+    angles = np.deg2rad((beam_edges[beam_nums] + beam_edges[beam_nums + 1]) / 2.)
+    bin_length = frame.sampleperiod * 0.000001 * frame.soundspeed / 2.
+    hyp = frame.WinStart + (bin_nums + 0.5) * bin_length
+
+    x = np.where(valid, np.sin(angles) * hyp, np.nan)
+    y = np.where(valid, np.cos(angles) * hyp, np.nan)
+
+    return x, y
+
+
+def image_to_xy(u, v, pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start):
+    """ Convert normalized image coordinates (u = column / xdim, v = row / ydim, the
+    convention of the annotations) to x,y locations in meters. Pixel (row, column)
+    of the image shows the location (x_meter_start + column * pixel_meter_size,
+    y_meter_start - row * pixel_meter_size).
+    """
+
+    x = x_meter_start + np.asarray(u, dtype=np.float64) * (xdim * pixel_meter_size)
+    y = y_meter_start - np.asarray(v, dtype=np.float64) * (ydim * pixel_meter_size)
+
+    return x, y
 
-    for beam_num in range(frame.BeamCount):
-        bl, br, fr, fl = get_box_for_sample(beam_num, 0, frame, beam_width_data)
 
-        # determine the axis aligned box around this sample box.
-        xs = [bl[0], br[0], fr[0], fl[0]]
-        ys = [bl[1], br[1], fr[1], fl[1]]
-        min_x = min(xs)
-        max_x = max(xs)
-        min_y = min(ys)
-        max_y = max(ys)
+def xy_to_image(x, y, pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start):
+    """ Convert x,y locations in meters to normalized image coordinates, the inverse
+    of image_to_xy().
+    """
+
+    u = (np.asarray(x, dtype=np.float64) - x_meter_start) / (xdim * pixel_meter_size)
+    v = (y_meter_start - np.asarray(y, dtype=np.float64)) / (ydim * pixel_meter_size)
+
+    return u, v
+
+
+def image_to_samples(u, v, pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start, frame, beam_data):
+    """ Find the beam samples shown at arrays of normalized image coordinates, i.e.
+    the samples that the pixels containing the coordinates read from in
+    compute_mapping_from_sample_to_image(). Coordinates outside of the image or of
+    the sonar fan are -1 in both returned arrays.
+
+    Returns:
+        beam_nums, bin_nums : int32 arrays
+    """
+
+    u, v = np.broadcast_arrays(np.asarray(u, dtype=np.float64), np.asarray(v, dtype=np.float64))
+
+    cols = np.floor(u * xdim)
+    rows = np.floor(v * ydim)
+    in_image = (cols >= 0) & (cols < xdim) & (rows >= 0) & (rows < ydim)
+
+    x = np.where(in_image, x_meter_start + cols * pixel_meter_size, np.nan)
+    y = np.where(in_image, y_meter_start - rows * pixel_meter_size, np.nan)
+
+    return xy_to_samples(x, y, frame, beam_data)
+
+
+def samples_to_image(beam_nums, bin_nums, pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start, frame, beam_data):
+    """ Convert arrays of beam samples to normalized image coordinates (see
+    samples_to_xy() and xy_to_image()). Samples outside of the frame are NaN.
+
+    Returns:
+        u, v : float64 arrays
+    """
+
+    x, y = samples_to_xy(beam_nums, bin_nums, frame, beam_data)
+
+    return xy_to_image(x, y, pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start)
+
+
+def get_minimum_pixel_meter_size(frame, beam_width_data):
+    """ Compute the smallest pixel size that will bound a sample.
+    """
 
-        width = max_x - min_x
-        height = max_y - min_y
+    corners = np.stack(get_boxes_for_samples(np.arange(frame.BeamCount), 0, frame, beam_width_data))
 
-        all_widths.append(width)
-        all_heights.append(height)
+    # determine the axis aligned box around each sample box.
+    widths = corners[..., 0].max(axis=0) - corners[..., 0].min(axis=0)
+    heights = corners[..., 1].max(axis=0) - corners[..., 1].min(axis=0)
 
-    min_width = min(all_widths)
-    min_height = min(all_heights)
+    min_width = widths.min()
+    min_height = heights.min()
 
     return min(min_width, min_height)
 
@@ -752,24 +1313,9 @@ def compute_image_bounds(pixel_meter_size, frame, beam_width_data, additional_pi
     """
 
     # Compute the projected locations of all samples so that we can get the extent
-    all_bl = []
-    all_br = []
-    all_fr = []
-    all_fl = []
-
-    for beam_num in [0, frame.BeamCount / 2, frame.BeamCount - 1]:
-        for bin_num in  [0, frame.samplesperbeam - 1]:
-            bl, br, fr, fl = get_box_for_sample(beam_num, bin_num, frame, beam_width_data)
-
-            all_bl.append(bl)
-            all_br.append(br)
-            all_fr.append(fr)
-            all_fl.append(fl)
-
-    all_bl = np.array(all_bl)
-    all_br = np.array(all_br)
-    all_fr = np.array(all_fr)
-    all_fl = np.array(all_fl)
+    beam_nums = np.array([0, frame.BeamCount / 2, frame.BeamCount - 1])[:, np.newaxis]
+    bin_nums = np.array([0, frame.samplesperbeam - 1])[np.newaxis, :]
+    all_bl, all_br, all_fr, all_fl = (corners.reshape(-1, 2) for corners in get_boxes_for_samples(beam_nums, bin_nums, frame, beam_width_data))
 
     # Get the xdim extent
     min_back_left = np.min(all_bl[:,0])
@@ -872,78 +1418,391 @@ def compute_image_bounds(pixel_meter_size, frame, beam_width_data, additional_pi
     return xdim, ydim, x_meter_start, y_meter_start, x_meter_stop, y_meter_stop
 
 
-def compute_mapping_from_sample_to_image(pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start, frame, beam_width_data):
+def compute_mapping_from_sample_to_image(pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start, frame, beam_width_data, flat=False):
+    """ Compute which sample of the frame data each pixel of the image reads from.
 
-    x_meter_values = np.array([x_meter_start + i * pixel_meter_size for i in range(xdim)])
-    y_meter_values = np.array([y_meter_start - i * pixel_meter_size for i in range(ydim)])
+    Returns:
+        read_from_rows, read_from_cols, write_to_rows, write_to_cols : int32 arrays such that
+            image[write_to_rows, write_to_cols] = frame.frame_data[read_from_rows, read_from_cols]
+        or, if `flat` is True,
+        read_from, write_to : int32 linear indices such that
+            image.reshape(-1)[write_to] = frame.frame_data.reshape(-1)[read_from]
+    """
 
-    YY, XX = np.meshgrid(y_meter_values, x_meter_values, indexing='ij')
-    XYpairs = np.vstack([ XX.reshape(-1), YY.reshape(-1) ]).T
+    x_meter_values = x_meter_start + np.arange(xdim) * pixel_meter_size
+    y_meter_values = y_meter_start - np.arange(ydim) * pixel_meter_size
 
-    II, JJ = np.meshgrid(np.arange(ydim), np.arange(xdim), indexing='ij')
-    IJpairs = np.vstack([ II.reshape(-1), JJ.reshape(-1)]).T
+    # Find the sample of every pixel, broadcasting the (1, xdim) and (ydim, 1) coordinates
+    beam_nums, bin_nums = xy_to_samples(x_meter_values[np.newaxis, :], y_meter_values[:, np.newaxis], frame, beam_width_data)
 
-    # Get the angle of the xy pairs
-    angles = np.rad2deg(np.arctan(XYpairs[:,0] / XYpairs[:,1]))
+    # Discard pixels that are outside of the sonar fan
+    write_to_rows, write_to_cols = np.nonzero(bin_nums >= 0)
+    read_from_rows = bin_nums[write_to_rows, write_to_cols]
+    read_from_cols = beam_nums[write_to_rows, write_to_cols]
+    write_to_rows = write_to_rows.astype(np.int32)
+    write_to_cols = write_to_cols.astype(np.int32)
 
-    # Discard pairs that have an angle that is out of range
-    min_angle = beam_width_data['beam_left'].min()
-    max_angle = beam_width_data['beam_right'].max()
-    valid_pairs = (angles > min_angle) & (angles < max_angle)
-    angles = angles[valid_pairs]
-    XYpairs = XYpairs[valid_pairs]
-    IJpairs = IJpairs[valid_pairs]
+    if flat:
+        read_from = read_from_rows * np.int32(frame.BeamCount) + read_from_cols
+        write_to = write_to_rows * np.int32(xdim) + write_to_cols
+        return read_from, write_to
 
-    # Get the distance of the xy pairs
-    hyp =  XYpairs[:,1] / np.cos(np.arctan(XYpairs[:,0] / XYpairs[:,1]))
+    return read_from_rows, read_from_cols, write_to_rows, write_to_cols
 
-    # Take into account the window start
-    hyp -= frame.WinStart
 
-    # Sample length
-    bin_length = frame.sampleperiod * 0.000001 * frame.soundspeed / 2.
+def make_remap_lut(read_from, write_to, xdim, ydim, num_samples):
+    """ Turn a flat mapping (see compute_mapping_from_sample_to_image(flat=True)) into
+    a (ydim, xdim) int32 gather index for remap_batch(). Pixels that are not mapped
+    index `num_samples`, one past the last sample, and are written as 0.
+    """
 
-    # Convert to bins
-    bin_nums = (hyp / bin_length).astype(np.int)
+    lut = np.full(ydim * xdim, num_samples, dtype=np.int32)
+    lut[write_to] = read_from
 
-    # Discard pairs that have a distance that is out of range
-    valid_pairs = (bin_nums >= 0) & (bin_nums < frame.samplesperbeam)
-    bin_nums = bin_nums[valid_pairs]
-    angles = angles[valid_pairs]
-    XYpairs = XYpairs[valid_pairs]
-    IJpairs = IJpairs[valid_pairs]
+    return lut.reshape(ydim, xdim)
 
 
-    beam_edges = beam_width_data['beam_left'].to_numpy()
-    beam_nums = np.digitize(angles, beam_edges) - 1
+def crop_sample_mapping(read_from_rows, read_from_cols, write_to_rows, write_to_cols, num_bins, num_beams,
+                        bin_range = None, bin_step = 1, beam_step = 1):
+    """ Adapt a mapping from compute_mapping_from_sample_to_image() to frames that
+    were read with a bin range and decimation (see crop_samples()). Pixels outside
+    of the bin range are dropped and the others read from the nearest kept sample.
 
-    # For each valid x,y pair compute which beam it falls into
-    write_to = [] # (i, j) of image
-    read_from = [] # (bin_num, beam_num) of frame data
-    for index in range(XYpairs.shape[0]):
+    Parameters
+    -----------
+    num_bins, num_beams : (Int) Shape of the full frame data
+    bin_range, bin_step, beam_step : as passed to crop_samples()
 
-        bin_num = bin_nums[index]
-        beam_num = beam_nums[index]
+    Returns:
+        read_from_rows, read_from_cols, write_to_rows, write_to_cols : int32 arrays
+            indexing into the cropped frame data, e.g. for make_remap_lut() with
+            `read_from_rows * cropped_beams + read_from_cols`
+    """
 
-        write_to.append(IJpairs[index])
-        read_from.append((bin_num, beam_num))
+    start, stop = _bin_range(bin_range, num_bins)
+    cropped_bins = len(range(start, stop, bin_step))
+    cropped_beams = len(range(0, num_beams, beam_step))
 
-    read_from = np.array(read_from)
-    read_from_rows = np.array(read_from[:,0])
-    read_from_cols = np.array(read_from[:,1])
+    keep = (read_from_rows >= start) & (read_from_rows < stop)
+    rows = np.minimum((read_from_rows[keep] - start + bin_step // 2) // bin_step, cropped_bins - 1)
+    cols = np.minimum((read_from_cols[keep] + beam_step // 2) // beam_step, cropped_beams - 1)
 
-    write_to = np.array(write_to)
-    write_to_rows = np.array(write_to[:,0])
-    write_to_cols = np.array(write_to[:,1])
+    return rows.astype(np.int32), cols.astype(np.int32), write_to_rows[keep], write_to_cols[keep]
 
-    return read_from_rows, read_from_cols, write_to_rows, write_to_cols
+
+def remap_batch(samples, lut, out=None, chunk_size=64):
+    """ Remap a stack of frames into images with a single gather per chunk of frames.
+
+    Parameters
+    -----------
+    samples : (N, bins, beams) uint8 array of frame data, e.g. the frames yielded by
+        ARISReader.iter_frames() or a slice of ARIS_File.frames
+    lut : (ydim, xdim) gather index from make_remap_lut()
+    out : (Optional) (N, ydim, xdim) uint8 array to write into, so the output
+        buffer can be reused across calls. Allocated if not given.
+    chunk_size : (Int) Number of frames gathered at once. Bounds the scratch memory.
+
+    Returns
+    -------
+    out : (N, ydim, xdim) uint8 array of images
+    """
+
+    N = samples.shape[0]
+    num_samples = samples.shape[1] * samples.shape[2]
+
+    if out is None:
+        out = np.empty((N,) + lut.shape, dtype=np.uint8)
+
+    # Scratch copy of the samples with a trailing zero that unmapped pixels read from.
+    # This also makes flipped or strided sample views contiguous.
+    padded = np.zeros((min(chunk_size, N), num_samples + 1), dtype=np.uint8)
+
+    for chunk_start in range(0, N, chunk_size):
+        chunk = samples[chunk_start:chunk_start + chunk_size]
+        n = chunk.shape[0]
+        padded[:n, :num_samples] = chunk.reshape(n, num_samples)
+        np.take(padded[:n], lut, axis=1, out=out[chunk_start:chunk_start + n], mode='clip')
+
+    return out
+
+
+#Frame header fields that determine the sonar geometry. The beam width table
+#is determined by the system type, ping mode (beam count) and lens.
+GEOMETRY_FIELDS = ('thesystemtype', 'pingmode', 'largelens', 'samplestartdelay', 'sampleperiod', 'soundspeed', 'samplesperbeam')
+
+def frame_geometry(frame):
+    """The geometry settings of a frame, as a hashable tuple. `frame` can be an
+    ARIS_Frame or a single FRAME_HEADER_DTYPE record."""
+
+    if isinstance(frame, np.void):
+        return tuple(frame[f].item() for f in GEOMETRY_FIELDS)
+    return tuple(getattr(frame, f) for f in GEOMETRY_FIELDS)
+
+
+class LUTCache:
+    """Cache for the lookup tables returned by compute_mapping_from_sample_to_image().
+
+    Tables are keyed on the frame geometry (see GEOMETRY_FIELDS) and the image
+    bounds, so a frame whose settings changed mid-file simply gets a different
+    table. The most recently used `maxsize` tables are kept in memory. If
+    `cache_dir` is given, tables are also stored there as .npz files, so they
+    survive across processes.
+    """
+
+    def __init__(self, maxsize = 16, cache_dir = None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self.tables = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.tables)
+
+    def clear(self):
+        self.tables.clear()
+
+    @staticmethod
+    def key(pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start, frame, flat=False):
+        return frame_geometry(frame) + tuple(float(v) for v in (pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start)) + (bool(flat),)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, 'lut_' + hashlib.sha1(repr(key).encode()).hexdigest() + '.npz')
+
+    def get(self, pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start, frame, beam_width_data, flat=False):
+        """Same arguments and return value as compute_mapping_from_sample_to_image(),
+        but only computes the table on a cache miss."""
+
+        key = LUTCache.key(pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start, frame, flat)
+
+        if key in self.tables:
+            self.hits += 1
+            self.tables.move_to_end(key)
+            return self.tables[key]
+
+        table = None
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            with np.load(self._path(key)) as f:
+                table = tuple(f['arr_%d' % i] for i in range(len(f.files)))
+
+        if table is None:
+            self.misses += 1
+            table = compute_mapping_from_sample_to_image(pixel_meter_size, xdim, ydim, x_meter_start, y_meter_start, frame, beam_width_data, flat)
+
+            if self.cache_dir is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                tmp_path = self._path(key) + '.%d.tmp.npz' % os.getpid()
+                np.savez(tmp_path, *table)
+                os.replace(tmp_path, self._path(key))
+        else:
+            self.hits += 1
+
+        self.tables[key] = table
+        while len(self.tables) > self.maxsize:
+            self.tables.popitem(last=False)
+
+        return table
+
+
+#Process wide lookup table cache, available as ARIS_File.LUP
+LUT_CACHE = LUTCache()
+
+
+class BackgroundModel:
+    """Streaming background model of the raw (bins, beams) frame data.
+
+    Every frame costs a constant number of element-wise operations on the
+    samples, and the model works before the remap, where frames are much
+    smaller than the images. The foreground frames have the same layout as
+    the input, so they can be passed to remap_batch() as usual.
+
+    Parameters
+    -----------
+    method : (Str) 'median' for an approximate running median (the background
+        moves `median_step` towards every new sample), or 'mean' for an
+        exponentially weighted running mean
+    alpha : (Float) Weight of a new frame in the running mean and variance
+    median_step : (Float) Intensity change of the running median per frame
+    threshold : (Float) If > 0, samples that are less than `threshold` running
+        standard deviations above the background are set to 0 in the foreground
+
+    Notes
+    -------
+    The model is reset when the frame geometry (see GEOMETRY_FIELDS, which
+    includes the window settings) or the frame shape changes, since samples
+    no longer line up with the background. The first frame after a reset
+    becomes the background, so its foreground is empty.
+
+    Example
+    -------
+    >>> model = pyARIS.BackgroundModel()
+    >>> for frames, headers in reader.iter_frames():
+    ...     images = pyARIS.remap_batch(model.apply(frames, headers), lut)
+    """
+
+    def __init__(self, method = 'median', alpha = 0.02, median_step = 1.0, threshold = 0.):
+        if method not in ('median', 'mean'):
+            raise ValueError("Unknown method: %s" % (method,))
+
+        self.method = method
+        self.alpha = alpha
+        self.median_step = median_step
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        self.background = None
+        self.variance = None
+        self.geometry = None
+        self.num_frames = 0
+
+    def _matches(self, frame_data, geometry):
+        return (self.background is not None and self.background.shape == frame_data.shape and
+                (geometry is None or geometry == self.geometry))
+
+    def update(self, frame_data, header = None):
+        """Add a frame to the model. `header` (an ARIS_Frame or FRAME_HEADER_DTYPE
+        record) is used to detect changes of the window settings."""
+
+        geometry = None if header is None else frame_geometry(header)
+
+        if not self._matches(frame_data, geometry):
+            self.reset()
+            self.background = frame_data.astype(np.float32)
+            self.variance = np.zeros(frame_data.shape, dtype=np.float32)
+            self._delta = np.empty(frame_data.shape, dtype=np.float32)
+            self._scratch = np.empty(frame_data.shape, dtype=np.float32)
+            self.geometry = geometry
+            self.num_frames = 1
+            return
+
+        delta = np.subtract(frame_data, self.background, out=self._delta, dtype=np.float32)
+
+        #Exponentially weighted variance: var = (1 - alpha) * (var + alpha * delta^2)
+        np.multiply(delta, delta, out=self._scratch)
+        self._scratch *= self.alpha
+        self.variance += self._scratch
+        self.variance *= 1 - self.alpha
+
+        if self.method == 'mean':
+            np.multiply(delta, self.alpha, out=self._scratch)
+        else:
+            np.sign(delta, out=self._scratch)
+            self._scratch *= self.median_step
+        self.background += self._scratch
+
+        self.num_frames += 1
+
+    def foreground(self, frame_data, out = None):
+        """The samples of a frame that are above the background, as a uint8 array
+        with the layout of `frame_data`."""
+
+        if out is None:
+            out = np.empty(frame_data.shape, dtype=np.uint8)
+
+        if self.background is None:
+            out[...] = frame_data
+            return out
+
+        fg = np.subtract(frame_data, self.background, out=self._scratch, dtype=np.float32)
+        if self.threshold > 0:
+            fg[fg < self.threshold * np.sqrt(self.variance)] = 0
+        np.clip(fg, 0, 255, out=fg)
+        out[...] = fg
+
+        return out
+
+    def apply(self, frames, headers = None, out = None):
+        """Background subtract a batch of consecutive frames and add them to the model.
+        Every frame is compared to the model of the frames before it.
+
+        Parameters
+        -----------
+        frames : (N, bins, beams) uint8 array, e.g. as yielded by ARISReader.iter_frames()
+        headers : (Optional) the (N,) frame headers, used to reset the model when
+            the window settings change
+        out : (Optional) (N, bins, beams) uint8 array to write into
+
+        Returns
+        -------
+        out : (N, bins, beams) uint8 array of foreground frames
+        """
+
+        if out is None:
+            out = np.empty(frames.shape, dtype=np.uint8)
+
+        for i in range(len(frames)):
+            header = None if headers is None else headers[i]
+            if self._matches(frames[i], None if header is None else frame_geometry(header)):
+                self.foreground(frames[i], out=out[i])
+            else:
+                out[i] = 0
+            self.update(frames[i], header)
+
+        return out
+
+
+_COLORMAP_TABLES = {}
+
+def colormap_table(name = 'viridis'):
+    """ A (256, 3) uint8 RGB lookup table for a named matplotlib colormap. Tables are
+    computed once per colormap and reused.
+    """
+
+    if name not in _COLORMAP_TABLES:
+        #matplotlib.colormaps replaces cm.get_cmap, which was removed in matplotlib 3.9
+        import matplotlib
+        table = matplotlib.colormaps[name](np.arange(256), bytes=True)[:, :3]
+        _COLORMAP_TABLES[name] = np.ascontiguousarray(table)
+
+    return _COLORMAP_TABLES[name]
+
+
+def colorize(image, table = None, out = None):
+    """ Colorize a uint8 image (or stack of images) by indexing into a colormap table.
+
+    Parameters
+    -----------
+    image : uint8 array of intensities
+    table : (256, 3) uint8 table from colormap_table(), or None to pass the
+        intensities through as grayscale
+    out : (Optional) uint8 array to write into, of shape image.shape + (3,)
+        (or image.shape for grayscale)
+
+    Returns
+    -------
+    out : the colorized image
+    """
+
+    if table is None:
+        if out is None:
+            return image
+        out[...] = image
+        return out
+
+    if out is None:
+        out = np.empty(image.shape + (3,), dtype=np.uint8)
+
+    return np.take(table, image, axis=0, out=out, mode='clip')
+
+
+def _encode_frame(frame_image, table, frame_path, frame_data = None, raw_path = None):
+    """Colorize and save a remapped frame (and optionally the raw samples) as JPEG."""
+
+    from PIL import Image
+
+    Image.fromarray(colorize(frame_image, table)).save(frame_path, 'JPEG')
+
+    if raw_path is not None:
+        Image.fromarray(np.uint8(frame_data), mode='L').save(raw_path, 'JPEG')
 
 
 def make_video(data,
     xdim, ydim, sample_read_rows, sample_read_cols, image_write_rows, image_write_cols,
-    directory, filename, fps = 24.0, start_frame = 1, end_frame = None, timestamp = False, fontsize = 30, ts_pos = (0,0), save_raw = False):
-    """Output video using the ffmpeg pipeline. The current implementation
-    outputs compresses png files and outputs a mp4.
+    directory, filename, fps = 24.0, start_frame = 1, end_frame = None, timestamp = False, fontsize = 30, ts_pos = (0,0), save_raw = False,
+    workers = 1, use_processes = False, output = 'jpeg', gray = False, ffmpeg = 'ffmpeg', cmap = 'viridis', background = None):
+    """Output the frames of a file as JPEG images in `directory/filename/frames/`, or
+    as a video at `directory/filename/filename.mp4` by piping the frames to ffmpeg.
 
     Parameters
     -----------
@@ -954,15 +1813,25 @@ def make_video(data,
     timestamp : (Bool) Add the timestamp from the sonar to the video frames
     fontsize : (Int) Size of timestamp font
     ts_pos : (Tuple) (x,y) location of the timestamp
+    workers : (Int) Number of threads (or processes) used to colorize and encode
+        frames. Frames keep their index based file names. Default = 1 (serial)
+    use_processes : (Bool) Use a process pool instead of a thread pool when workers > 1
+    output : (Str) 'jpeg' to write one JPEG per frame, or 'ffmpeg' to stream raw
+        frames to an ffmpeg subprocess that writes the mp4 directly
+    gray : (Bool) Output the remapped intensities as grayscale instead of colorizing them
+    ffmpeg : (Str) ffmpeg executable used when output = 'ffmpeg'
+    cmap : (Str) Name of the matplotlib colormap used to colorize frames
+    background : (Optional) BackgroundModel. Frames are background subtracted
+        before they are remapped. Raw frames (save_raw) are saved as read.
 
     Returns
     -------
-    Returns a video into the current working directory
+    Writes the frames or video into `directory/filename/`
 
     Notes
     ------
-    Currently this function looks for ffmpeg.exe in the current working directory.
-    Must have the '*.mp4' file extension.
+    With output = 'ffmpeg' frames are written to ffmpeg's stdin as they are
+    remapped, so a slow encoder blocks the export instead of buffering frames.
     Uses the tqdm package to display a status bar.
 
     Example
@@ -971,39 +1840,125 @@ def make_video(data,
 
     """
 
-    #Command to send via the command prompt which specifies the pipe parameters
-    # command = ['ffmpeg',
-    #        '-y', # (optional) overwrite output file if it exists
-    #        '-f', 'image2pipe',
-    #        '-vcodec', 'mjpeg', #'mjpeg',
-    #        '-r', '1',
-    #        '-r', str(fps), # frames per second
-    #        '-i', '-', # The input comes from a pipe
-    #        '-an', # Tells FFMPEG not to expect any audio
-    #        '-vcodec', 'mpeg4',
-    #        '-b:v', '5000k',
-    #        directory + filename + "/"+filename+".mp4",
-    #        '-hide_banner',
-    #        '-loglevel', 'panic']
+    if output not in ('jpeg', 'ffmpeg'):
+        raise ValueError("Unknown output: %s" % (output,))
 
     # Create directories if they don't exist
-    if not os.path.exists(os.path.join(directory, filename, 'frames/')):
+    if output == 'jpeg' and not os.path.exists(os.path.join(directory, filename, 'frames/')):
         os.makedirs(os.path.join(directory, filename, 'frames/'))
+    if output == 'ffmpeg' and not os.path.exists(os.path.join(directory, filename)):
+        os.makedirs(os.path.join(directory, filename))
     if save_raw and not os.path.exists(os.path.join(directory, filename, 'frames-raw/')):
         os.makedirs(os.path.join(directory, filename, 'frames-raw/'))
 
     if end_frame == None:
         end_frame = data.FrameCount
 
-    cm = colormap.get_cmap('viridis')
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    from PIL import Image
+    import tqdm
 
-    for i, frame_offset in enumerate(tqdm.tqdm(range(start_frame, end_frame))):
-        frame = FrameRead(data, frame_offset)
-        frame_image = np.zeros([ydim, xdim], dtype=np.uint8)
-        frame_image[image_write_rows, image_write_cols] = frame.frame_data[sample_read_rows, sample_read_cols]
+    table = None if gray else colormap_table(cmap)
 
-        rgb_im = Image.fromarray(cm(frame_image, bytes=True)).convert('RGB')
-        rgb_im.save(os.path.join(directory, filename, 'frames/', f'{i}.jpg'), 'JPEG')
+    reader = ARISReader(data.filename)
+    progress = tqdm.tqdm(total=max(end_frame - start_frame, 0))
 
-        if save_raw:
-            Image.fromarray(np.uint8(frame.frame_data), mode='L').save(os.path.join(directory, filename, 'frames-raw/', f'{i}.jpg'), 'JPEG')
+    lut = None
+    images = None
+
+    proc = None
+    pool = None
+    batches = None
+    completed = False
+    #Clean up the reader, pool and ffmpeg even if a frame fails to export
+    try:
+        if output == 'ffmpeg':
+            #Command to send via the command prompt which specifies the pipe parameters
+            command = [ffmpeg,
+                   '-y', # (optional) overwrite output file if it exists
+                   '-f', 'rawvideo',
+                   '-vcodec', 'rawvideo',
+                   '-s', f'{xdim}x{ydim}', # size of one frame
+                   '-pix_fmt', 'gray' if gray else 'rgb24',
+                   '-r', str(fps), # frames per second
+                   '-i', '-', # The input comes from a pipe
+                   '-an', # Tells FFMPEG not to expect any audio
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', # the encoder needs even dimensions
+                   '-vcodec', 'mpeg4',
+                   '-b:v', '5000k',
+                   os.path.join(directory, filename, filename + '.mp4'),
+                   '-hide_banner',
+                   '-loglevel', 'panic']
+            proc = sp.Popen(command, stdin=sp.PIPE)
+
+        if workers > 1 and proc is None:
+            pool = (ProcessPoolExecutor if use_processes else ThreadPoolExecutor)(max_workers=workers)
+        pending = deque()
+
+        i = 0
+        batches = reader.iter_frames(start_frame, end_frame)
+        for frames, headers in batches:
+            if lut is None:
+                num_beams = frames.shape[2]
+                lut = make_remap_lut(np.asarray(sample_read_rows) * num_beams + np.asarray(sample_read_cols),
+                                     np.asarray(image_write_rows) * xdim + np.asarray(image_write_cols),
+                                     xdim, ydim, frames.shape[1] * num_beams)
+                images = np.empty((len(frames), ydim, xdim), dtype=np.uint8)
+                rgb = np.empty((ydim, xdim, 3), dtype=np.uint8)
+
+            samples = frames if background is None else background.apply(frames, headers)
+
+            for frame_data, frame_image in zip(frames, remap_batch(samples, lut, out=images[:len(frames)])):
+                if proc is not None:
+                    # Blocks while ffmpeg's pipe is full
+                    try:
+                        proc.stdin.write(colorize(frame_image, table, None if gray else rgb))
+                    except BrokenPipeError:
+                        raise RuntimeError("ffmpeg exited with status %d" % (proc.wait(),))
+                    if save_raw:
+                        Image.fromarray(np.uint8(frame_data), mode='L').save(os.path.join(directory, filename, 'frames-raw/', f'{i}.jpg'), 'JPEG')
+                    i += 1
+                    progress.update(1)
+                    continue
+
+                args = (frame_image, table, os.path.join(directory, filename, 'frames/', f'{i}.jpg'))
+                if save_raw:
+                    args += (frame_data, os.path.join(directory, filename, 'frames-raw/', f'{i}.jpg'))
+
+                if pool is None:
+                    _encode_frame(*args)
+                    progress.update(1)
+                else:
+                    # Bound the number of frames in flight
+                    pending.append(pool.submit(_encode_frame, *args))
+                    while len(pending) > 2 * workers:
+                        pending.popleft().result()
+                        progress.update(1)
+
+                i += 1
+
+            # The image buffer is reused by the next batch
+            while pending:
+                pending.popleft().result()
+                progress.update(1)
+
+        completed = True
+    finally:
+        if batches is not None:
+            batches.close()
+        if pool is not None:
+            pool.shutdown(cancel_futures=not completed)
+        progress.close()
+        reader.close()
+
+        if proc is not None:
+            if not completed:
+                proc.kill()
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            proc.wait()
+
+    if proc is not None and proc.returncode != 0:
+        raise RuntimeError("ffmpeg exited with status %d" % (proc.returncode,))
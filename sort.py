@@ -16,17 +16,114 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 from filterpy.kalman import KalmanFilter
+from functools import lru_cache
+from itertools import permutations
+from math import perm
 import numpy as np
 
-def linear_assignment(cost_matrix):
+def lapjv_assignment(cost_matrix):
+    import lap
+    _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
+    cols = x[x >= 0]
+    return np.stack([y[cols], cols], axis=1)
+
+
+def scipy_assignment(cost_matrix):
+    from scipy.optimize import linear_sum_assignment
+    x, y = linear_sum_assignment(cost_matrix)
+    return np.stack([x, y], axis=1)
+
+
+def greedy_assignment(cost_matrix):
+    """
+    Assigns the pairs in order of increasing cost, skipping rows and columns that are taken.
+    Not optimal in general, but cheap and close to optimal when targets rarely overlap.
+    """
+    rows, cols = np.unravel_index(np.argsort(cost_matrix, axis=None, kind='stable'), cost_matrix.shape)
+    row_taken = np.zeros(cost_matrix.shape[0], dtype=bool)
+    col_taken = np.zeros(cost_matrix.shape[1], dtype=bool)
+    assigned = []
+    for r, c in zip(rows.tolist(), cols.tolist()):
+        if not row_taken[r] and not col_taken[c]:
+            row_taken[r] = col_taken[c] = True
+            assigned.append((r, c))
+            if len(assigned) == min(cost_matrix.shape):
+                break
+    return np.array(sorted(assigned), dtype=int).reshape(-1, 2)
+
+
+# Largest problem brute_force_assignment accepts, in number of candidate assignments
+BRUTE_FORCE_MAX_PERMUTATIONS = 720
+
+@lru_cache(maxsize=None)
+def _permutations(n, k):
+    return np.array(list(permutations(range(n), k)), dtype=int).reshape(-1, k)
+
+
+def brute_force_assignment(cost_matrix):
+    """
+    Exact assignment by trying every one, for very small matrices (see BRUTE_FORCE_MAX_PERMUTATIONS).
+    """
+    if cost_matrix.shape[0] > cost_matrix.shape[1]:
+        assigned = brute_force_assignment(cost_matrix.T)[:, ::-1]
+        return assigned[np.argsort(assigned[:, 0])]
+    if perm(cost_matrix.shape[1], cost_matrix.shape[0]) > BRUTE_FORCE_MAX_PERMUTATIONS:
+        raise ValueError('Matrix of shape %s is too large for brute force assignment' % (cost_matrix.shape,))
+    rows = np.arange(cost_matrix.shape[0])
+    perms = _permutations(cost_matrix.shape[1], cost_matrix.shape[0])
+    best = perms[np.argmin(cost_matrix[rows, perms].sum(axis=1))]
+    return np.stack([rows, best], axis=1)
+
+
+@lru_cache(maxsize=None)
+def _lap_available():
     try:
         import lap
-        _, x, y = lap.lapjv(cost_matrix, extend_cost=True)
-        return np.array([[y[i],i] for i in x if i >= 0]) #
+        return True
     except ImportError:
-        from scipy.optimize import linear_sum_assignment
-        x, y = linear_sum_assignment(cost_matrix)
-        return np.array(list(zip(x, y)))
+        return False
+
+
+# Assignment solvers by name. Each takes a cost matrix and returns the (row, column) pairs of a
+# minimum cost assignment as an (n, 2) int array sorted by row.
+ASSIGNMENT_SOLVERS = {
+    'lapjv': lapjv_assignment,
+    'scipy': scipy_assignment,
+    'greedy': greedy_assignment,
+    'brute_force': brute_force_assignment,
+}
+
+def get_solver(name='auto'):
+    """
+    Looks up an assignment solver once, so that the choice (and the lap import) is not repeated every frame.
+    'exact' is lapjv if the lap package is installed and scipy otherwise. 'auto' picks the solver by
+    matrix size: a single row or column is solved with argmin and everything else with scipy, which
+    has the lowest call overhead and is as fast as lapjv up to hundreds of targets (see
+    assignment_benchmark.py). A callable is returned unchanged.
+    """
+    if callable(name):
+        return name
+    if name == 'exact':
+        return lapjv_assignment if _lap_available() else scipy_assignment
+    if name == 'auto':
+        return auto_assignment
+    if name not in ASSIGNMENT_SOLVERS:
+        raise ValueError('Unknown assignment solver: %s' % (name,))
+    return ASSIGNMENT_SOLVERS[name]
+
+
+def auto_assignment(cost_matrix):
+    if cost_matrix.size == 0:
+        return np.empty((0, 2), dtype=int)
+    if cost_matrix.shape[0] == 1:
+        return np.array([[0, np.argmin(cost_matrix[0])]])
+    if cost_matrix.shape[1] == 1:
+        return np.array([[np.argmin(cost_matrix[:, 0]), 0]])
+    return scipy_assignment(cost_matrix)
+
+
+def linear_assignment(cost_matrix):
+    return get_solver('exact')(cost_matrix)
 
 
 def iou_batch(bb_test, bb_gt):                                                                                                   
@@ -48,6 +145,17 @@ def iou_batch(bb_test, bb_gt):
     return(o)  
 
 
+def iou_pairs(bb_a, bb_b):
+    """
+    Computes the IOU of each pair of boxes bb_a[i], bb_b[i] in the form [x1,y1,x2,y2]
+    """
+    w = np.maximum(0., np.minimum(bb_a[:, 2], bb_b[:, 2]) - np.maximum(bb_a[:, 0], bb_b[:, 0]))
+    h = np.maximum(0., np.minimum(bb_a[:, 3], bb_b[:, 3]) - np.maximum(bb_a[:, 1], bb_b[:, 1]))
+    wh = w * h
+    return wh / ((bb_a[:, 2] - bb_a[:, 0]) * (bb_a[:, 3] - bb_a[:, 1])
+        + (bb_b[:, 2] - bb_b[:, 0]) * (bb_b[:, 3] - bb_b[:, 1]) - wh)
+
+
 def convert_bbox_to_z(bbox):
     """
     Takes a bounding box in the form [x1,y1,x2,y2] and returns z in the form
@@ -81,9 +189,10 @@ class KalmanBoxTracker(object):
     This class represents the internal state of individual tracked objects observed as bbox.
     """
     count = 0
-    def __init__(self,bbox):
+    def __init__(self,bbox,track_id=None):
         """
-        Initialises a tracker using initial bounding box.
+        Initialises a tracker using initial bounding box. If track_id is not given, the id is taken
+        from the process wide KalmanBoxTracker.count.
         """
         #define constant velocity model
         self.kf = KalmanFilter(dim_x=7, dim_z=4) 
@@ -98,8 +207,10 @@ class KalmanBoxTracker(object):
 
         self.kf.x[:4] = convert_bbox_to_z(bbox)
         self.time_since_update = 0
-        self.id = KalmanBoxTracker.count
-        KalmanBoxTracker.count += 1
+        if track_id is None:
+            track_id = KalmanBoxTracker.count
+            KalmanBoxTracker.count += 1
+        self.id = track_id
         self.history = []
         self.hits = 0
         self.hit_streak = 0
@@ -140,9 +251,10 @@ class KalmanBoxTracker(object):
         return convert_x_to_bbox(self.kf.x, score=self.curr_score)
 
 
-def associate_detections_to_trackers(detections,trackers,iou_threshold = 0.3):
+def associate_detections_to_trackers(detections,trackers,iou_threshold = 0.3,solver = linear_assignment):
     """
-    Assigns detections to tracked object (both represented as bounding boxes)
+    Assigns detections to tracked object (both represented as bounding boxes), with solver
+    (see ASSIGNMENT_SOLVERS) resolving conflicts
 
     Returns 3 lists of matches, unmatched_detections and unmatched_trackers
     """
@@ -156,45 +268,135 @@ def associate_detections_to_trackers(detections,trackers,iou_threshold = 0.3):
         if a.sum(1).max() == 1 and a.sum(0).max() == 1:
             matched_indices = np.stack(np.where(a), axis=1)
         else:
-            matched_indices = linear_assignment(-iou_matrix)
+            matched_indices = solver(-iou_matrix)
     else:
         matched_indices = np.empty(shape=(0,2))
 
-    unmatched_detections = []
-    for d, _ in enumerate(detections):
-        if(d not in matched_indices[:,0]):
-            unmatched_detections.append(d)
-    unmatched_trackers = []
-    for t, _ in enumerate(trackers):
-        if(t not in matched_indices[:,1]):
-            unmatched_trackers.append(t)
-
-  #filter out matched with low IOU
-    matches = []
-    for m in matched_indices:
-        if(iou_matrix[m[0], m[1]]<iou_threshold):
-            unmatched_detections.append(m[0])
-            unmatched_trackers.append(m[1])
-        else:
-            matches.append(m.reshape(1,2))
-    if(len(matches)==0):
-        matches = np.empty((0,2),dtype=int)
-    else:
-        matches = np.concatenate(matches,axis=0)
+    matched_indices = matched_indices.astype(int)
+    return split_matches(matched_indices, iou_matrix[matched_indices[:,0], matched_indices[:,1]], len(detections), len(trackers), iou_threshold)
+
+
+def split_matches(matched_indices, matched_iou, num_detections, num_trackers, iou_threshold):
+    """
+    Splits assigned (detection, tracker) pairs into matches and unmatched detections and trackers.
+    Unassigned indices come first, followed by the assigned pairs with an IOU below the threshold.
+    """
+    low = matched_iou < iou_threshold
+
+    detection_assigned = np.zeros(num_detections, dtype=bool)
+    detection_assigned[matched_indices[:,0]] = True
+    tracker_assigned = np.zeros(num_trackers, dtype=bool)
+    tracker_assigned[matched_indices[:,1]] = True
+
+    unmatched_detections = np.concatenate([np.nonzero(~detection_assigned)[0], matched_indices[low,0]])
+    unmatched_trackers = np.concatenate([np.nonzero(~tracker_assigned)[0], matched_indices[low,1]])
+
+    return matched_indices[~low].reshape(-1,2), unmatched_detections, unmatched_trackers
+
+
+def overlapping_pairs(bb_a, bb_b):
+    """
+    Finds the pairs of boxes [x1,y1,x2,y2] of bb_a and bb_b that overlap, without comparing every pair:
+    bb_b is sorted by x1, and each box of bb_a is only compared to the boxes of bb_b whose x1 is within
+    the widest box of bb_b to the left of it and not past its x2.
+
+    Returns 2 arrays of indices into bb_a and bb_b
+    """
+    if len(bb_a) == 0 or len(bb_b) == 0:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    order = np.argsort(bb_b[:,0], kind='stable')
+    x1 = bb_b[order,0]
+    max_width = np.max(bb_b[:,2] - bb_b[:,0])
+    lo = np.searchsorted(x1, bb_a[:,0] - max_width, side='left')
+    hi = np.searchsorted(x1, bb_a[:,2], side='left')
+    counts = np.maximum(hi - lo, 0)
+
+    a = np.repeat(np.arange(len(bb_a)), counts)
+    b = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - lo, counts)]
+
+    overlap = ((np.minimum(bb_a[a,2], bb_b[b,2]) > np.maximum(bb_a[a,0], bb_b[b,0])) &
+               (np.minimum(bb_a[a,3], bb_b[b,3]) > np.maximum(bb_a[a,1], bb_b[b,1])))
+    return a[overlap], b[overlap]
+
+
+def associate_detections_to_trackers_gated(detections,trackers,iou_threshold = 0.3,solver = linear_assignment):
+    """
+    Same as associate_detections_to_trackers, for frames with many boxes. Only the IOU of overlapping
+    pairs is computed (see overlapping_pairs) and the assignment is solved separately for each connected
+    component of the overlap graph, so the cost grows with the number of overlapping pairs rather than
+    with detections x trackers. Gives the same matches up to ties between equally good assignments,
+    but unmatched detections can be listed in a different order.
+
+    Returns 3 lists of matches, unmatched_detections and unmatched_trackers
+    """
+    if(len(trackers)==0):
+        return np.empty((0,2),dtype=int), np.arange(len(detections)), np.empty((0,5),dtype=int)
+
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    d, t = overlapping_pairs(detections, trackers)
+    iou = iou_pairs(detections[d], trackers[t])
+    num_detections, num_trackers = len(detections), len(trackers)
+
+    matched_indices = [np.stack([d, t], axis=1)[:0]]
+    matched_iou = [iou[:0]]
+    a = iou > iou_threshold
+    if a.any() and np.bincount(d[a]).max() == 1 and np.bincount(t[a]).max() == 1:
+        matched_indices.append(np.stack([d[a], t[a]], axis=1))
+        matched_iou.append(iou[a])
+    elif len(d):
+        # Detections are nodes 0..num_detections-1 and trackers follow
+        graph = coo_matrix((np.ones(len(d)), (d, num_detections + t)), shape=(num_detections + num_trackers,) * 2)
+        _, labels = connected_components(graph, directed=False)
+        pair_labels = labels[d]
 
-    return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
+        # Components with a single detection or a single tracker need no assignment: the pair with
+        # the highest IOU is matched
+        num_component_detections = np.bincount(labels[:num_detections], minlength=labels.max() + 1)
+        num_component_trackers = np.bincount(labels[num_detections:], minlength=labels.max() + 1)
+        star = np.nonzero((num_component_detections[pair_labels] == 1) | (num_component_trackers[pair_labels] == 1))[0]
+        star = star[np.lexsort((-iou[star], pair_labels[star]))]
+        best = star[np.r_[True, pair_labels[star][1:] != pair_labels[star][:-1]]] if len(star) else star
+        matched_indices.append(np.stack([d[best], t[best]], axis=1))
+        matched_iou.append(iou[best])
+
+        rest = np.nonzero((num_component_detections[pair_labels] > 1) & (num_component_trackers[pair_labels] > 1))[0]
+        rest = rest[np.argsort(pair_labels[rest], kind='stable')]
+        for component in np.split(rest, np.nonzero(np.diff(pair_labels[rest]))[0] + 1):
+            if len(component) == 0:
+                continue
+            component_detections, rows = np.unique(d[component], return_inverse=True)
+            component_trackers, cols = np.unique(t[component], return_inverse=True)
+            component_iou = np.zeros((len(component_detections), len(component_trackers)))
+            component_iou[rows, cols] = iou[component]
+
+            assigned = solver(-component_iou).reshape(-1, 2)
+            matched_indices.append(np.stack([component_detections[assigned[:,0]], component_trackers[assigned[:,1]]], axis=1))
+            matched_iou.append(component_iou[assigned[:,0], assigned[:,1]])
+
+    return split_matches(np.concatenate(matched_indices).astype(int), np.concatenate(matched_iou), num_detections, num_trackers, iou_threshold)
 
 
 class Sort(object):
-    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, gated=False, solver='exact'):
         """
-        Sets key parameters for SORT
+        Sets key parameters for SORT. If gated is True, detections are associated with
+        associate_detections_to_trackers_gated, which is faster for frames with many boxes.
+        solver is the assignment solver, by name (see get_solver) or as a function. The default 'exact'
+        gives the same tracks as before solvers could be chosen; other solvers can break ties differently,
+        which changes the order new track ids are handed out in.
         """
         self.max_age = max_age
         self.min_hits = min_hits
         self.iou_threshold = iou_threshold
+        self.associate = associate_detections_to_trackers_gated if gated else associate_detections_to_trackers
+        self.solver = get_solver(solver)
         self.trackers = []
         self.frame_count = 0
+        # Ids are counted per instance, so they do not depend on what else was tracked in the process
+        self.next_id = 0
 
     def update(self, dets=np.empty((0, 5))):
         """
@@ -222,7 +424,7 @@ class Sort(object):
         trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
         for t in reversed(to_del):
             self.trackers.pop(t)
-        matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(dets, trks, self.iou_threshold)
+        matched, unmatched_dets, unmatched_trks = self.associate(dets, trks, self.iou_threshold, self.solver)
 
         # update matched trackers with assigned detections
         for m in matched:
@@ -230,7 +432,8 @@ class Sort(object):
 
         # create and initialise new trackers for unmatched detections
         for i in unmatched_dets:
-            trk = KalmanBoxTracker(dets[i,:])
+            trk = KalmanBoxTracker(dets[i,:], self.next_id)
+            self.next_id += 1
             self.trackers.append(trk)
         i = len(self.trackers)
         for trk in reversed(self.trackers):
@@ -244,3 +447,147 @@ class Sort(object):
         if(len(ret)>0):
             return np.concatenate(ret)
         return np.empty((0,6))
+
+    def track_clip(self, dets, frame_idx, num_frames=None):
+        """
+        Tracks a whole clip in one call.
+        Params:
+        dets - a numpy array of every detection of the clip in the format [[x1,y1,x2,y2,score],...]
+        frame_idx - the frame (0 based, within the clip) of each detection
+        num_frames - number of frames in the clip, by default the last frame with a detection + 1
+
+        Returns:
+            frames, track_ids, bboxes, scores - one row per tracked box, in frame order, with the
+            same track ids, boxes and scores as calling update once per frame
+        """
+        dets = np.asarray(dets, dtype=float).reshape(-1, 5)
+        frame_idx = np.asarray(frame_idx, dtype=int)
+        if num_frames is None:
+            num_frames = frame_idx.max() + 1 if len(frame_idx) else 0
+
+        order = np.argsort(frame_idx, kind='stable')
+        dets = dets[order]
+        bounds = np.searchsorted(frame_idx[order], np.arange(num_frames + 1))
+
+        frames = []
+        tracks = [np.empty((0,6))]
+        for f in range(num_frames):
+            tracks.append(self.update(dets[bounds[f]:bounds[f+1]]))
+            frames.append(np.full(len(tracks[-1]), f))
+        tracks = np.concatenate(tracks)
+
+        frames = np.concatenate(frames).astype(int) if len(frames) else np.empty(0, dtype=int)
+        return frames, tracks[:,5].astype(int), tracks[:,:4], tracks[:,4]
+
+
+# Constant velocity model of KalmanBoxTracker, shared by every track of a BatchSort
+KF_F = np.array([[1,0,0,0,1,0,0],[0,1,0,0,0,1,0],[0,0,1,0,0,0,1],[0,0,0,1,0,0,0],  [0,0,0,0,1,0,0],[0,0,0,0,0,1,0],[0,0,0,0,0,0,1]], dtype=float)
+KF_H = np.array([[1,0,0,0,0,0,0],[0,1,0,0,0,0,0],[0,0,1,0,0,0,0],[0,0,0,1,0,0,0]], dtype=float)
+KF_R = np.diag([1., 1., 10., 10.])
+KF_Q = np.diag([1., 1., 1., 1., 0.01, 0.01, 0.0001])
+KF_P0 = np.diag([10., 10., 10., 10., 10000., 10000., 10000.])
+
+
+def convert_bboxes_to_z(bboxes):
+    """
+    Vectorized convert_bbox_to_z: takes (N, 4+) boxes [x1,y1,x2,y2,...] and returns (N, 4) [x,y,s,r]
+    """
+    w = bboxes[:, 2] - bboxes[:, 0]
+    h = bboxes[:, 3] - bboxes[:, 1]
+    return np.stack([bboxes[:, 0] + w/2., bboxes[:, 1] + h/2., w * h, w / h], axis=1)
+
+
+def convert_xs_to_bboxes(xs):
+    """
+    Vectorized convert_x_to_bbox: takes (N, 4+) states [x,y,s,r,...] and returns (N, 4) [x1,y1,x2,y2]
+    """
+    with np.errstate(invalid='ignore'):
+        w = np.sqrt(xs[:, 2] * xs[:, 3])
+    h = xs[:, 2] / w
+    return np.stack([xs[:, 0]-w/2., xs[:, 1]-h/2., xs[:, 0]+w/2., xs[:, 1]+h/2.], axis=1)
+
+
+class BatchSort(Sort):
+    """
+    SORT with the Kalman filters of all tracks stored together, as (N, 7) states and
+    (N, 7, 7) covariances, so that every frame runs a few batched NumPy operations
+    instead of one filterpy predict() / update() per track. Gives the same tracks
+    as Sort (within floating point tolerance) and can be passed to Tracker as the
+    `algorithm`.
+    """
+    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, gated=False, solver='exact'):
+        super().__init__(max_age, min_hits, iou_threshold, gated, solver)
+        self.x = np.empty((0, 7))
+        self.P = np.empty((0, 7, 7))
+        self.ids = np.empty(0, dtype=int)
+        self.scores = np.empty(0)
+        self.time_since_update = np.empty(0, dtype=int)
+        self.hits = np.empty(0, dtype=int)
+        self.hit_streak = np.empty(0, dtype=int)
+        self.age = np.empty(0, dtype=int)
+
+    def _keep(self, mask):
+        for name in ('x', 'P', 'ids', 'scores', 'time_since_update', 'hits', 'hit_streak', 'age'):
+            setattr(self, name, getattr(self, name)[mask])
+
+    def _predict(self):
+        self.x[self.x[:, 6] + self.x[:, 2] <= 0, 6] = 0.
+        self.x = self.x @ KF_F.T
+        self.P = KF_F @ self.P @ KF_F.T + KF_Q
+        self.age += 1
+        self.hit_streak[self.time_since_update > 0] = 0
+        self.time_since_update += 1
+
+    def _update(self, idx, dets):
+        # Same equations as filterpy's KalmanFilter.update, including the Joseph form covariance update
+        P = self.P[idx]
+        y = convert_bboxes_to_z(dets) - self.x[idx, :4]
+        PHT = P[:, :, :4]
+        K = PHT @ np.linalg.inv(PHT[:, :4, :] + KF_R)
+        self.x[idx] += (K @ y[:, :, np.newaxis])[:, :, 0]
+        I_KH = np.eye(7) - K @ KF_H
+        self.P[idx] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ KF_R @ K.transpose(0, 2, 1)
+
+        self.time_since_update[idx] = 0
+        self.hits[idx] += 1
+        self.hit_streak[idx] += 1
+        self.scores[idx] = dets[:, 4]
+
+    def _add(self, dets):
+        n = len(dets)
+        x = np.zeros((n, 7))
+        x[:, :4] = convert_bboxes_to_z(dets)
+        self.x = np.concatenate([self.x, x])
+        self.P = np.concatenate([self.P, np.broadcast_to(KF_P0, (n, 7, 7))])
+        self.ids = np.concatenate([self.ids, self.next_id + np.arange(n)])
+        self.next_id += n
+        self.scores = np.concatenate([self.scores, dets[:, 4]])
+        for name in ('time_since_update', 'hits', 'hit_streak', 'age'):
+            setattr(self, name, np.concatenate([getattr(self, name), np.zeros(n, dtype=int)]))
+
+    def update(self, dets=np.empty((0, 5))):
+        """
+        Same as Sort.update.
+        """
+        self.frame_count += 1
+
+        self._predict()
+        trks = np.concatenate([convert_xs_to_bboxes(self.x), self.scores[:, np.newaxis]], axis=1)
+        valid = np.all(np.isfinite(trks), axis=1)
+        self._keep(valid)
+        trks = trks[valid]
+
+        matched, unmatched_dets, unmatched_trks = self.associate(dets, trks, self.iou_threshold, self.solver)
+
+        if len(matched):
+            self._update(matched[:, 1], dets[matched[:, 0]])
+        if len(unmatched_dets):
+            self._add(dets[unmatched_dets.astype(int)])
+
+        # Same output order as Sort: newest tracks first
+        ret = (self.time_since_update < 1) & ((self.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits))
+        ret = np.concatenate([convert_xs_to_bboxes(self.x[ret]), self.scores[ret, np.newaxis], self.ids[ret, np.newaxis] + 1.], axis=1)[::-1]
+
+        self._keep(self.time_since_update <= self.max_age)
+
+        return ret
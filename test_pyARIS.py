@@ -0,0 +1,137 @@
+import os
+import struct
+import numpy as np
+import pytest
+
+import catalog
+import import_benchmark
+import pyARIS
+
+
+def write_aris_file(path, num_frames, pingmode, samples, beams, seed = 0, timestamps = None):
+    """Write a synthetic ARIS file with random samples and return the (frames,
+    samples, beams) sample block as it is stored on disk. The frames are 100 ms
+    apart unless their sonartimestamps are given."""
+
+    rng = np.random.default_rng(seed)
+
+    file_header = bytearray(1024)
+    struct.pack_into('IIIIIfI', file_header, 0, 0x05464444, num_frames, 10, 1, beams, 1.0, samples)
+
+    records = np.zeros(num_frames, dtype=np.dtype([('header', pyARIS.FRAME_HEADER_DTYPE), ('samples', np.uint8, (samples, beams))]))
+    records['header']['frameindex'] = np.arange(num_frames)
+    records['header']['sonartimestamp'] = 1600000000000000 + np.arange(num_frames) * 100000 if timestamps is None else timestamps
+    records['header']['pingmode'] = pingmode
+    records['header']['samplesperbeam'] = samples
+    records['header']['samplestartdelay'] = 1000
+    records['header']['soundspeed'] = 1480
+    records['samples'] = rng.integers(0, 256, records['samples'].shape, dtype=np.uint8)
+
+    with open(path, 'wb') as f:
+        f.write(file_header)
+        f.write(records.tobytes())
+
+    return records['samples']
+
+
+def reference_frame_data(filename, ARIS_data, frameIndex, samplesperbeam, beam_count):
+    """The per-sample loop FrameRead used before samples were decoded with one read."""
+
+    FrameSize = ARIS_data.NumRawBeams*ARIS_data.SamplesPerChannel
+    frameoffset = (1024+(frameIndex*(1024+(FrameSize))))
+
+    with open(filename, 'rb') as data:
+        data.seek(frameoffset+1024, 0)
+        frame = np.empty([samplesperbeam, beam_count], dtype=float)
+        for r in range(len(frame)):
+            for c in range(len(frame[r])):
+                frame[r][c] = struct.unpack('B', data.read(1))[0]
+
+    return np.fliplr(frame)
+
+
+@pytest.mark.parametrize('pingmode, beams', [(1, 48), (3, 96), (9, 128)])
+def test_frame_read_matches_per_sample_loop(tmp_path, pingmode, beams):
+    filename = str(tmp_path / 'synthetic.aris')
+    write_aris_file(filename, 3, pingmode, 40, beams)
+    ARIS_data, _ = pyARIS.DataImport(filename, startFrame = 0)
+
+    for frameIndex in range(3):
+        frame = pyARIS.FrameRead(ARIS_data, frameIndex)
+        expected = reference_frame_data(filename, ARIS_data, frameIndex, 40, beams)
+
+        assert frame.frameindex == frameIndex
+        assert frame.frame_data.shape == expected.shape
+        np.testing.assert_array_equal(frame.frame_data, expected)
+
+
+@pytest.mark.parametrize('num_frames, glitched', [(20, [8, 10]), (8, [4, 6]), (20, [8, 9]), (20, [8, 9, 10]),
+                                                  (20, [0, 2]), (20, [17, 19]), (20, [5, 8])])
+@pytest.mark.parametrize('glitch_time', [0, 2 ** 62])
+def test_timestamp_lookups_skip_glitches(tmp_path, num_frames, glitched, glitch_time):
+    filename = str(tmp_path / 'glitched.aris')
+    timestamps = 1600000000000000 + np.arange(num_frames) * 100000
+    timestamps[glitched] = glitch_time
+    write_aris_file(filename, num_frames, 1, 4, 48, timestamps = timestamps)
+    ARIS_data, _ = pyARIS.DataImport(filename, startFrame = 0)
+
+    valid = np.nonzero(~catalog.find_glitches(timestamps))[0]
+    np.testing.assert_array_equal(valid, np.setdiff1d(np.arange(num_frames), glitched))
+
+    for i in valid:
+        assert ARIS_data.frame_at_time(int(timestamps[i])) == i
+        if i < valid[-1]:
+            assert ARIS_data.frame_at_time(int(timestamps[i]) + 50000) == i
+        assert ARIS_data.frames_between(int(timestamps[i]), int(timestamps[i])) == range(i, i + 1)
+
+    assert ARIS_data.frames_between(int(timestamps[valid[0]]), int(timestamps[valid[-1]])) == range(valid[0], valid[-1] + 1)
+
+
+FAKE_FFMPEG = """#!/bin/sh
+# Stand-in for ffmpeg that saves its arguments and the raw frames piped to it
+echo "$@" > "$(dirname "$0")/args"
+cat > "$(dirname "$0")/stdin"
+"""
+
+
+def make_identity_video(tmp_path, num_frames, samples, beams, **kwargs):
+    """Write a synthetic file and export it with make_video, mapping sample (r, c) to
+    image pixel (r, c). Returns the (frames, samples, beams) samples as on disk."""
+
+    filename = str(tmp_path / 'video.aris')
+    records = write_aris_file(filename, num_frames, 1, samples, beams)
+    ARIS_data, _ = pyARIS.DataImport(filename, startFrame = 0)
+
+    rows, cols = np.repeat(np.arange(samples), beams), np.tile(np.arange(beams), samples)
+    pyARIS.make_video(ARIS_data, beams, samples, rows, cols, rows, cols, str(tmp_path), 'video',
+                      start_frame = 0, end_frame = num_frames, output = 'ffmpeg', **kwargs)
+
+    return records
+
+
+@pytest.mark.parametrize('gray', [True, False])
+def test_make_video_pipes_raw_frames_to_ffmpeg(tmp_path, gray):
+    ffmpeg = tmp_path / 'ffmpeg'
+    ffmpeg.write_text(FAKE_FFMPEG)
+    os.chmod(ffmpeg, 0o755)
+
+    records = make_identity_video(tmp_path, 5, 8, 12, gray = gray, ffmpeg = str(ffmpeg))
+
+    args = (tmp_path / 'args').read_text().split()
+    assert args[args.index('-s') + 1] == '12x8'
+    assert args[args.index('-pix_fmt') + 1] == ('gray' if gray else 'rgb24')
+
+    raw = np.frombuffer((tmp_path / 'stdin').read_bytes(), dtype=np.uint8)
+    assert len(raw) == 5 * 8 * 12 * (1 if gray else 3)
+    if gray:
+        np.testing.assert_array_equal(raw.reshape(5, 8, 12), records[:, :, ::-1])
+
+
+def test_make_video_raises_when_ffmpeg_fails(tmp_path):
+    with pytest.raises(RuntimeError, match='ffmpeg exited with status 1'):
+        make_identity_video(tmp_path, 5, 8, 12, ffmpeg = '/bin/false')
+
+
+def test_import_does_not_load_deferred_modules():
+    # The slow imports only the image export needs must stay inside the functions that use them
+    assert import_benchmark.loaded_deferred_modules('pyARIS', cwd = os.path.dirname(os.path.abspath(pyARIS.__file__))) == []
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from sort import Sort, BatchSort
+
+
+def synthetic_clip(num_frames, num_targets, seed):
+    """Detections of targets moving at constant velocity, with jittered boxes, missed
+    detections and false positives.
+
+    Returns:
+        dets, frame_idx - every detection of the clip in the format [x1,y1,x2,y2,score]
+            and the frame of each detection
+    """
+
+    rng = np.random.default_rng(seed)
+
+    centers = rng.uniform(0.1, 0.9, (num_targets, 2))
+    velocities = rng.normal(0, 0.003, (num_targets, 2))
+    sizes = rng.uniform(0.02, 0.08, (num_targets, 2))
+
+    dets = []
+    frame_idx = []
+    for f in range(num_frames):
+        c = centers + f * velocities
+        boxes = np.concatenate([c - sizes / 2, c + sizes / 2], axis=1) + rng.normal(0, 0.002, (num_targets, 4))
+        boxes = boxes[rng.uniform(size=num_targets) > 0.1]
+
+        false_positives = rng.uniform(0, 0.95, (rng.poisson(1), 2))
+        boxes = np.concatenate([boxes, np.concatenate([false_positives, false_positives + 0.05], axis=1)])
+
+        dets.append(np.concatenate([boxes, rng.uniform(0.3, 1, (len(boxes), 1))], axis=1))
+        frame_idx.append(np.full(len(boxes), f))
+
+    return np.concatenate(dets), np.concatenate(frame_idx)
+
+
+def track_frames(tracker, dets, frame_idx, num_frames):
+    """The output of tracker.update for each frame of the clip."""
+
+    return [tracker.update(dets[frame_idx == f]) for f in range(num_frames)]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_batch_sort_matches_sort(seed):
+    dets, frame_idx = synthetic_clip(100, 30, seed)
+    args = {'max_age': 2, 'min_hits': 3, 'iou_threshold': 0.1}
+
+    expected = track_frames(Sort(**args), dets, frame_idx, 100)
+    tracks = track_frames(BatchSort(**args), dets, frame_idx, 100)
+
+    for f in range(100):
+        assert tracks[f].shape == expected[f].shape
+        assert np.allclose(tracks[f], expected[f])
+
+
+@pytest.mark.parametrize('algorithm', [Sort, BatchSort])
+def test_track_clip_matches_update(algorithm):
+    dets, frame_idx = synthetic_clip(100, 30, 0)
+    # Detections do not need to be sorted by frame, only kept in order within a frame
+    order = np.argsort(-frame_idx, kind='stable')
+
+    expected = track_frames(algorithm(max_age=2, iou_threshold=0.1), dets, frame_idx, 100)
+    frames, track_ids, bboxes, scores = algorithm(max_age=2, iou_threshold=0.1).track_clip(dets[order], frame_idx[order], 100)
+
+    expected_frames = np.concatenate([np.full(len(t), f) for f, t in enumerate(expected)])
+    expected = np.concatenate(expected)
+    np.testing.assert_array_equal(frames, expected_frames)
+    np.testing.assert_array_equal(track_ids, expected[:, 5])
+    assert np.allclose(bboxes, expected[:, :4])
+    assert np.allclose(scores, expected[:, 4])
+
+
+@pytest.mark.parametrize('algorithm', [Sort, BatchSort])
+def test_gated_matches_full_association(algorithm):
+    dets, frame_idx = synthetic_clip(100, 30, 1)
+
+    expected = track_frames(algorithm(max_age=2, iou_threshold=0.1), dets, frame_idx, 100)
+    tracks = track_frames(algorithm(max_age=2, iou_threshold=0.1, gated=True), dets, frame_idx, 100)
+
+    # Track ids can be handed out in another order, but must stay consistent over the clip
+    id_map = {}
+    for f in range(100):
+        assert tracks[f].shape == expected[f].shape
+        t = tracks[f][np.lexsort(tracks[f][:, :4].T)]
+        e = expected[f][np.lexsort(expected[f][:, :4].T)]
+        assert np.allclose(t[:, :5], e[:, :5])
+        for track_id, expected_id in zip(t[:, 5], e[:, 5]):
+            assert id_map.setdefault(track_id, expected_id) == expected_id
+
+    assert len(set(id_map.values())) == len(id_map)
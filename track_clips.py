@@ -0,0 +1,106 @@
+from absl import app
+from absl import flags
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import numpy as np
+import os
+
+from sort import Sort, BatchSort
+from tracker import Tracker
+
+flags.DEFINE_string(
+	'clips_json', None, 'Json list of clip infos (see data_format.md), e.g. the dump written by gen_clips.py.'
+)
+flags.DEFINE_string(
+	'detections_dir', None, 'Directory with a <clip_name>.json per clip: one list of normalized [x1, y1, x2, y2, score] boxes per frame of the clip.'
+)
+flags.DEFINE_string(
+	'output_dir', None, 'Directory to output a <clip_name>.json of tracks per clip.'
+)
+flags.DEFINE_enum(
+	'algorithm', 'sort', ['sort', 'batch_sort'], 'Tracking algorithm, sort.Sort or sort.BatchSort.'
+)
+flags.DEFINE_integer(
+	'max_age', 1, 'Number of frames a track survives without a detection.'
+)
+flags.DEFINE_integer(
+	'min_hits', 3, 'Number of frames a fish must be tracked in to be kept.'
+)
+flags.DEFINE_float(
+	'iou_threshold', 0.05, 'Minimum IOU of a detection and a track to match them.'
+)
+flags.DEFINE_float(
+	'min_length', -1.0, 'Minimum fish length in meters, -1 to keep every fish.'
+)
+flags.DEFINE_integer(
+	'workers', 1, 'Number of clips tracked concurrently.'
+)
+flags.mark_flag_as_required('clips_json')
+flags.mark_flag_as_required('detections_dir')
+flags.mark_flag_as_required('output_dir')
+FLAGS = flags.FLAGS
+
+ALGORITHMS = {'sort': Sort, 'batch_sort': BatchSort}
+
+def track_clip_file(clip_info, detections_path, output_path, algorithm='sort',
+	args={'max_age':1, 'min_hits':0, 'iou_threshold':0.05}, min_hits=3, min_length=-1.0):
+	"""Run a Tracker over the detections of one clip and write its finalized tracks
+	to output_path. Track ids only depend on the clip, since every clip gets its own
+	tracker (and id counter).
+
+	Returns:
+		output_path
+	"""
+
+	with open(detections_path) as detections_file:
+		detections = json.load(detections_file)
+
+	dets = np.array([box for frame_detections in detections for box in frame_detections], dtype=float).reshape(-1, 5)
+	frame_idx = np.repeat(np.arange(len(detections)), [len(frame_detections) for frame_detections in detections])
+
+	# Fish lengths need the image width in meters, which the gen_clips.py dump only has as aris_info
+	if 'image_meter_width' not in clip_info:
+		clip_info = dict(clip_info, image_meter_width=clip_info['aris_info']['pixel_meter_size'] * clip_info['aris_info']['xdim'])
+
+	tracker = Tracker(clip_info, algorithm=ALGORITHMS[algorithm], args=args, min_hits=min_hits)
+	tracker.track_clip(dets, frame_idx, len(detections))
+	tracker.finalize(output_path, min_length=min_length)
+
+	return output_path
+
+def track_clips(clips, detections_dir, output_dir, workers=1, **kwargs):
+	"""Track many clips, `workers` at a time, in separate processes. Each clip's
+	tracks are written to output_dir/<clip_name>.json as soon as it is done, and
+	the output is the same for any number of workers. Keyword arguments are passed
+	on to track_clip_file().
+
+	Yields:
+		the output paths, in the order the clips finish
+	"""
+
+	os.makedirs(output_dir, exist_ok=True)
+
+	jobs = [(clip, os.path.join(detections_dir, clip['clip_name'] + '.json'), os.path.join(output_dir, clip['clip_name'] + '.json'))
+		for clip in clips]
+
+	if workers <= 1:
+		for job in jobs:
+			yield track_clip_file(*job, **kwargs)
+		return
+
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		futures = [pool.submit(track_clip_file, *job, **kwargs) for job in jobs]
+		for future in as_completed(futures):
+			yield future.result()
+
+def main(argv):
+	with open(FLAGS.clips_json) as json_file:
+		clips = json.load(json_file)
+
+	args = {'max_age': FLAGS.max_age, 'min_hits': 0, 'iou_threshold': FLAGS.iou_threshold}
+	for i, output_path in enumerate(track_clips(clips, FLAGS.detections_dir, FLAGS.output_dir, workers=FLAGS.workers,
+		algorithm=FLAGS.algorithm, args=args, min_hits=FLAGS.min_hits, min_length=FLAGS.min_length)):
+		print(f'[{i + 1}/{len(clips)}] {output_path}')
+
+if __name__ == '__main__':
+	app.run(main)
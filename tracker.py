@@ -37,6 +37,41 @@ class Tracker:
             })
         self.frame_id += 1
     
+    # Tracks a whole clip at once: dets are all [x1,y1,x2,y2,score] boxes of the clip and frame_idx
+    # the frame of each box, counted from start_frame. Returns the tracks as columns
+    # (frames, track_ids, bboxes, scores) and adds them to the json data as update would.
+    def track_clip(self, dets, frame_idx, num_frames=None):
+        frames, track_ids, bboxes, scores = self.algorithm.track_clip(dets, frame_idx, num_frames)
+        if num_frames is None:
+            num_frames = np.max(frame_idx) + 1 if len(frame_idx) else 0
+        self.add_columns(frames, track_ids, bboxes, scores, num_frames)
+        return frames, track_ids, bboxes, scores
+
+    # Appends tracks given as columns (see track_clip), rows of a frame in the order the algorithm
+    # returned them, to the json data in the same format as update
+    def add_columns(self, frames, track_ids, bboxes, scores, num_frames):
+        # count fish in order of appearance, like update, since finalize numbers them in that order
+        ids, first, counts = np.unique(track_ids, return_index=True, return_counts=True)
+        for i in np.argsort(first):
+            self.fish_ids[int(ids[i])] += int(counts[i])
+
+        order = np.lexsort((track_ids, frames))
+        bounds = np.searchsorted(frames[order], np.arange(num_frames + 1))
+        track_ids, bboxes, scores = track_ids[order].tolist(), bboxes[order].tolist(), scores[order].tolist()
+        for f in range(num_frames):
+            self.json_data['frames'].append(
+                {
+                    'frame_num': self.frame_id,
+                    'fish': [{
+                        'fish_id': track_ids[i],
+                        'bbox': bboxes[i],
+                        'score': scores[i],
+                        'visible': 1,
+                        'human_labeled': 0
+                    } for i in range(bounds[f], bounds[f+1])]
+                })
+            self.frame_id += 1
+
     def finalize(self, output_path=None, min_length=-1.0): # vert_margin=0.0
         json_data = deepcopy(self.json_data)
             